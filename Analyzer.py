@@ -1,4 +1,5 @@
 import random
+import numpy as np
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -15,25 +16,36 @@ tritoneRange     = ( -5, 0)
 phrygianRange    = ( -5, 0)
 diatonicRange    = (  1, 2)
 
+coefficientNames = ["selfCoefficient", "domCoefficient", "domSubCoefficient", "minorCoefficient", "majorCoefficient",
+                    "triadicCoefficient", "leadingToneCoefficient", "tritoneCoefficient", "phrygianCoefficient",
+                    "diatonicCoefficient"]
+
+coefficientRanges = [selfRange, domRange, domSubRange, minorRange, majorRange,
+                     triadicRange, leadingToneRange, tritoneRange, phrygianRange, diatonicRange]
+
+#   Index of the note found n semitones above each of the 12 tonics, e.g. intervals[9][7] is E, the fifth above A
+intervals = (np.arange(12)[:, np.newaxis] + np.arange(12)[np.newaxis, :]) % 12
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 class Configuration:
 
-    #   The Configuration object is a set of coefficients that are used to analyze a track's key. If no parameters are
-    #   included, a random configuration within the ranges above will be created
+    #   The Configuration object is a set of coefficients that are used to analyze a track's key. It can be built from
+    #   a dictionary of coefficients, such as the one produced by toDictionary. If no parameters are included, a random
+    #   configuration within the ranges above will be created
 
         def __init__(self, input = None):
             if isinstance(input, dict):
-                self.selfCoefficient        = input.selfCoefficient
-                self.domCoefficient         = input.domCoefficient
-                self.domSubCoefficient      = input.domSubCoefficient
-                self.minorCoefficient       = input.minorCoefficient
-                self.majorCoefficient       = input.majorCoefficient
-                self.triadicCoefficient     = input.triadicCoefficient
-                self.leadingToneCoefficient = input.leadingToneCoefficient
-                self.tritoneCoefficient     = input.tritoneCoefficient
-                self.phrygianCoefficient    = input.phrygianCoefficient
-                self.diatonicCoefficient    = input.diatonicCoefficient
+                self.selfCoefficient        = input["selfCoefficient"]
+                self.domCoefficient         = input["domCoefficient"]
+                self.domSubCoefficient      = input["domSubCoefficient"]
+                self.minorCoefficient       = input["minorCoefficient"]
+                self.majorCoefficient       = input["majorCoefficient"]
+                self.triadicCoefficient     = input["triadicCoefficient"]
+                self.leadingToneCoefficient = input["leadingToneCoefficient"]
+                self.tritoneCoefficient     = input["tritoneCoefficient"]
+                self.phrygianCoefficient    = input["phrygianCoefficient"]
+                self.diatonicCoefficient    = input["diatonicCoefficient"]
             else:
                 if isinstance(input, str) and input == "Orchestral":
                     self.selfCoefficient        =  1.98
@@ -72,12 +84,17 @@ class Configuration:
                     "phrygianCoefficient"    : round(self.phrygianCoefficient   , 2),
                     "diatonicCoefficient"    : round(self.diatonicCoefficient   , 2)}
 
+
+        def toArray(self):
+            return np.array([getattr(self, name) for name in coefficientNames])
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 class TonalityScorer:
 
     #   Scoring tool used to analyze the key of a track. Uses coefficients from a configuration to grade the
-    #   various harmonic relationships relative to the key being scored
+    #   various harmonic relationships relative to the key being scored. scoreTonalities below computes the same
+    #   scores for every tonic, track and configuration at once
 
         def __init__(self, notes, note, configuration):
             self.note             = note
@@ -159,3 +176,86 @@ class TonalityScorer:
                 return minorRelationship * self.configuration.diatonicCoefficient
             else:
                 return majorRelationship * self.configuration.diatonicCoefficient
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def scoreTonalities(presences, coefficients):
+
+    #   Matrix form of TonalityScorer. Takes a (tracks x 12) array of note presences and a (configurations x 10) array
+    #   of coefficients ordered as coefficientNames, returning the (configurations x tracks x 12) scores that
+    #   App.calculateTonic would give each tonic. Every relationship is linear in the coefficients, so the scores are
+    #   a constant term plus one product of a (tracks x 12 x 10) relationship tensor with the coefficients
+
+        presences    = np.asarray(presences,    dtype=np.float64).reshape(-1, 12)
+        coefficients = np.asarray(coefficients, dtype=np.float64).reshape(-1, len(coefficientNames))
+
+    #   Presences of the notes n semitones above each tonic, as (tracks x tonics x n)
+        notes = presences[:, intervals]
+
+        principalPower = presences.max(axis=1)[:, np.newaxis]
+        principalPower = np.where(principalPower > 0, principalPower, np.inf)  # Silent tracks score 0 for every tonic
+
+        unison           = notes[..., 0]
+        minorSecondAbove = notes[..., 1]
+        majorSecondAbove = notes[..., 2]
+        minorThirdAbove  = notes[..., 3]
+        majorThirdAbove  = notes[..., 4]
+        fourthAbove      = notes[..., 5]
+        tritoneAbove     = notes[..., 6]
+        fifthAbove       = notes[..., 7]
+        majorThirdBelow  = notes[..., 8]
+        minorThirdBelow  = notes[..., 9]
+        majorSecondBelow = notes[..., 10]
+        minorSecondBelow = notes[..., 11]
+
+        relationships = np.zeros(notes.shape[:2] + (len(coefficientNames),))
+
+    #   The leading tone relationship ignores its coefficient when the major second below is the stronger of the two
+        minorLeadingTone = majorSecondBelow > minorSecondBelow
+        leadingTone      = np.where(minorLeadingTone,
+                                    (minorSecondBelow + majorSecondBelow)
+                                  * (np.minimum(majorSecondBelow, minorSecondBelow)
+                                   / np.where(minorLeadingTone, majorSecondBelow, 1)) / principalPower,
+                                    0.0)
+
+        minorDiatonic = ((unison + majorSecondAbove + minorThirdAbove + fourthAbove
+                        + fifthAbove + majorThirdBelow + majorSecondBelow) / 7) / principalPower
+        majorDiatonic = ((unison + majorSecondAbove + majorThirdAbove + fourthAbove
+                        + fifthAbove + minorThirdBelow + minorSecondBelow) / 7) / principalPower
+
+        relationships[..., 1] = fifthAbove / principalPower
+        relationships[..., 2] = ((fourthAbove + fifthAbove) / 2) / principalPower
+        relationships[..., 3] = (minorThirdBelow - minorThirdAbove) / principalPower
+        relationships[..., 4] = (minorThirdAbove - minorThirdBelow) / principalPower
+        relationships[..., 5] = ((unison + (minorThirdAbove + majorThirdAbove) + fifthAbove) / 3) / principalPower
+        relationships[..., 6] = np.where(minorLeadingTone, 0.0, minorSecondBelow / principalPower)
+        relationships[..., 7] = tritoneAbove / principalPower
+        relationships[..., 8] = minorSecondAbove / principalPower
+        relationships[..., 9] = np.maximum(minorDiatonic, majorDiatonic)
+
+        constant = unison / principalPower + leadingTone
+        scores   = constant[np.newaxis] + np.einsum("tnr,cr->ctn", relationships, coefficients)
+
+        return np.round(scores * 10, 2)
+
+
+def getTonics(scores):
+
+    #   Returns the index of the highest scoring tonic along the last axis of a score array. Ties go to the
+    #   lowest index, as they do when App.calculateTonic sorts its scores
+
+        return np.argmax(scores, axis=-1)
+
+
+def getModes(presences, tonics):
+
+    #   Matrix form of App.getMode. Takes a (tracks x 12) array of note presences and an array of tonic indices
+    #   whose last axis runs over tracks, returning True where the key of the tonic is minor
+
+        presences = np.asarray(presences, dtype=np.float64).reshape(-1, 12)
+        tracks    = np.arange(len(presences))
+
+        minorModalPower = presences[tracks, (tonics + 3) % 12] + presences[tracks, (tonics + 8) % 12]
+        majorModalPower = presences[tracks, (tonics + 4) % 12] + presences[tracks, (tonics + 9) % 12]
+
+        return minorModalPower > majorModalPower
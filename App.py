@@ -1,14 +1,19 @@
 import numpy as np
-import soundfile as sf
 from pathlib import Path
 from Note import Note
-import tkinter.filedialog
 import Analyzer
+import Spectrum
+import FeatureCache
+import Ingest
+import PcmCache
 import multiprocessing
-from multiprocessing import Pool
-from math import ceil
 import time
+from multiprocessing.pool import ThreadPool
 import Playlists
+import Executor
+import Scanner
+import Metrics
+import TrackTable
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -26,10 +31,43 @@ segmentSize      = 32768       # FFT size
 overlapOffset    = int((segmentSize / 2) + (segmentSize - (segmentSize * overlapCoefficient)))
 segmentIncrement = int(segmentSize + (segmentSize * overlapCoefficient) / increments)
 blackmanWindow   = np.blackman(segmentSize)
+buffersPerBatch  = 8           # Amount of buffers whose segments are transformed together
 
 cores = multiprocessing.cpu_count()  # Number of cores to be used in multiprocessing
 genre = "Orchestral"                 # Can be used to opt for different types of analyses
 
+streamingAnalysis = False            # Decode tracks block by block instead of all at once, keeping memory use flat
+resampling        = False            # Resample tracks to a common analysis rate, so that all share one bin layout
+analysisDtype     = np.float64       # Precision of the analysis, np.float32 halves its memory use
+pcmCacheDirectory = None             # Folder in which decoded mono audio is kept between runs, see PcmCache
+pcmCacheSize      = PcmCache.maximumSize
+standardRates     = [22050, 32000, 44100, 48000, 88200, 96000]
+
+adaptiveAnalysis     = False         # Stop analyzing a track once its keys are settled and clear enough
+coarseBuffers        = 16            # Buffers spread across the track before an adaptive analysis may stop
+confidenceInterval   = 8             # Buffers analyzed between confidence checks
+requiredStableChecks = 2             # Consecutive checks finding the same keys needed to stop
+confidenceThreshold  = 0.15          # Margin between the best and runner-up tonic scores needed to stop
+
+partialAnalysis      = False         # Only analyze the opening and closing regions of tracks, and a sparse stride between
+partialEdgeSeconds   = 20            # Length of the opening and closing regions of a partial analysis
+partialStrideSeconds = 60            # Spacing of the buffers analyzed between the opening and closing regions
+
+spectralBackends     = {"Orchestral": "fft"}  # Spectral backend by genre, "fft" (the default) or "filterbank"
+fftBackend           = "numpy"       # Library of the fft backend's transforms, "numpy" or "scipy"
+fftWorkers           = 1             # Threads of each scipy transform, -1 for one per core
+analysisThreads      = 1             # Threads analyzing the buffers of one decoded track, each over its own time range
+
+instrumentation      = False         # Record the time spent in each stage of the analysis, and counters, see Metrics
+metricsPath          = "Metrics"     # Recorded metrics are written to this path, with .json and .prom extensions
+
+#   Settings above that may be changed at runtime, which are handed to worker processes along with their work, as a
+#   worker started by spawn or forkserver imports this module afresh rather than inheriting them
+analysisSettings = ("genre", "streamingAnalysis", "resampling", "analysisDtype", "pcmCacheDirectory", "pcmCacheSize",
+                    "adaptiveAnalysis", "coarseBuffers", "confidenceInterval", "requiredStableChecks",
+                    "confidenceThreshold", "partialAnalysis", "partialEdgeSeconds", "partialStrideSeconds",
+                    "spectralBackends", "fftBackend", "fftWorkers", "analysisThreads", "buffersPerBatch")
+
 index = 0
 noteDictionary = {}       # Build dictionary of notes
 for i in range(-57, 52):  # C0 - C9
@@ -42,10 +80,18 @@ for i in range(-57, 52):  # C0 - C9
 
     index += 1
 
+#   Power above the 6th octave is unlikely to be that of a fundamental's
+fundamentalNotes = [note for note in noteDictionary.values() if note.octave < 6]
+noteEngines      = {}  # NotePowerEngines, by sample rate and analysis length
+noteFilterbanks  = {}  # NoteFilterbanks, by sample rate
+pcmCaches        = {}  # PcmCaches, by directory and ingest parameters
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 def main():
 
+        Metrics.enabled = instrumentation
+
     #   Prompt the user to select a folder, adding all valid tracks to list
         tracks = getPlaylist()
 
@@ -54,13 +100,9 @@ def main():
             track.configuration = Analyzer.Configuration("Orchestral")
             track.genre         = genre
 
-    #   Determine how many tracks should be processed by each core
-        chunkSize = int(ceil(len(tracks) / cores))
-
     #   Analyse tracks using multiprocessing
-        pool = Pool(processes = cores)
-        analyzedTracks = pool.map(analyzeTrack, tracks, chunkSize)
-        pool.close()
+        with Executor.AnalysisExecutor(cores) as executor:
+            analyzedTracks = list(executor.analyze(tracks))
 
     #   Create playlist of the given tracks
         playlist: list[Track] = Playlists.buildPlaylist(analyzedTracks)
@@ -68,11 +110,20 @@ def main():
         for track in playlist:
             print(track.easyKey + " ~ " + track.name)
 
+        if instrumentation:
+            Path(metricsPath + ".json").write_text(Metrics.toJson())
+            Path(metricsPath + ".prom").write_text(Metrics.toPrometheus())
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 class Track:
 
-    #   The Track object is initialized with the file path of a track and contains its metadata
+    #   The Track object is initialized with the file path of a track and contains its metadata. Libraries too large
+    #   to hold as Tracks are held in a TrackTable
+
+        __slots__ = ("filePath", "extension", "name", "startKey", "endKey", "easyKey", "length", "duration",
+                     "configuration", "genre", "halfwaySample", "confidence", "contentHash", "presence", "startPresence",
+                     "endPresence")
 
         def __init__(self, filePath, extension, name):
             self.filePath      = filePath
@@ -82,9 +133,12 @@ class Track:
             self.endKey        = None
             self.easyKey       = None
             self.length        = None
+            self.duration      = None  # Seconds
             self.configuration = None
             self.genre         = None
             self.halfwaySample = None
+            self.confidence    = None
+            self.contentHash   = None  # Hash of the file's contents, if the Scanner already read it
             self.presence      = dict.fromkeys(chromaticScale, 0.0)
             self.startPresence = dict.fromkeys(chromaticScale, 0.0)
             self.endPresence   = dict.fromkeys(chromaticScale, 0.0)
@@ -94,6 +148,8 @@ class Key:
 
     #   The Key object includes the tonics of a piece and whether the key is minor or major-based
 
+        __slots__ = ("tonic", "mode")
+
         def __init__(self, tonic, mode):
             self.tonic = tonic
             self.mode  = mode
@@ -104,21 +160,23 @@ class Buffer:
     #   The Buffer object holds an analysis performed on a discrete time frame of
     #   a track, along with other related metrics
 
-        def __init__(self, analysis, dcOffset, sampleRate, sample):
+        def __init__(self, analysis, dcOffset, sampleRate, sample, engine = None):
             self.analysis   = analysis
             self.dcOffset   = dcOffset
             self.binSize    = sampleRate / len(analysis)
             self.sampleRate = sampleRate
             self.sample     = sample
+            self.engine     = engine  # The engine that finds the fundamentals of the analysis, if not an FFT's
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 def getPlaylist(directoryPath = None):
 
-    #   Get and return a list of tracks from the user's device
+    #   Get and return a list of the tracks in a folder of the user's device and its subfolders
 
     #   If no path is specified, prompt the user to select a folder
         if directoryPath == None:
+            import tkinter.filedialog
 
             root = tkinter.Tk()
             root.withdraw()
@@ -130,117 +188,404 @@ def getPlaylist(directoryPath = None):
         else:
             directoryPath = Path(directoryPath)
 
-        filePaths = directoryPath.glob('*')
-
-        tracks: list[Track] = []
+        scan = Scanner.ScanResult()
 
     #   Create a list of Track objects. Non-compatible files will be ignored
-        for filePath in filePaths:
-            extension = filePath.suffix[1:]
-            name = filePath.stem
-            if extension.upper() in supportedFileExtensions:
-                tracks.append(Track(str(filePath), extension, name))
-            else:
-                print(str(filePath) + " is not a supported audio file")
+        tracks: list[Track] = [Scanner.getTrack(filePath) for filePath, _ in Scanner.findFiles(directoryPath, scan)]
+
+        if scan.unsupported:
+            print(str(scan.unsupported) + " unsupported files were ignored")
 
         return tracks
 
 
-def analyzeTrack(track):
+def analyzeTrack(track, featureCache = None, partial = None):
 
-    #   Get audio data and sampling rate from track
-        data, sampleRate = sf.read(track.filePath, always_2d=True)
+    #   Extracts the features of a track and identifies its key(s)
 
-    #   Convert to mono for fourier transform
-        data = convertToMono(data)
+        extractFeatures(track, featureCache, partial)
+        assignTrackKeys(track)
 
-        seconds             = len(data) / sampleRate
-        track.length        = str(int(seconds // 60)) + ":" + str(int(seconds % 60)).zfill(2)
-        track.halfwaySample = int(len(data) / 2)
+        return track
 
-        sequencingIncrement = int(sequencingCoefficient * sampleRate)  # Time value to iterate by
 
-    #   Iterate through the track
-        for i in range(0, int(seconds / sequencingCoefficient)):
+def extractFeatures(track, featureCache = None, partial = None):
 
-            sample = i * sequencingIncrement
+    #   Measures the note presences of a track, which only depend on its audio. If a FeatureCache is given, features
+    #   extracted by an earlier run with the same analysis parameters are reused instead of decoding the track again.
+    #   Whether only part of the track is analyzed can be given, overriding partialAnalysis, in which case the cache is
+    #   not used, as its entries are keyed by partialAnalysis. A track hashed by the Scanner is not read again to hash
+    #   it
 
-            timer = int(time.time() * 1000)
-            analyses = getSegmentAnalyses(data, sample)
-            #print("Analyzed in: "  + str(int(time.time() * 1000) - timer))
+        contentHash = track.contentHash
+        partial     = partialAnalysis if partial is None else partial
 
-        #   Average all segments
-            analysis = np.average(analyses, axis=0)
+        if partial != partialAnalysis:
+            featureCache = None
 
-        #   Collect the DC offset (zero-frequency) and remove it to make the array length coincide with samples / 2
-            dcOffset = analysis[0]
-            analysis = analysis[1:]
+        if featureCache is not None:
+            contentHash = contentHash or FeatureCache.hashFile(track.filePath)
+            if featureCache.load(track, contentHash):
+                Metrics.count("cacheHits")
+                return track
 
-            buffer = Buffer(analysis, dcOffset, sampleRate, sample)
+    #   Either map the track's decoded audio from the PcmCache, decode the track block by block, seeking past the
+    #   parts a partial analysis skips, or get all of its audio data and sampling rate at once and convert it to mono
+    #   for fourier transform. A mapped track is only paged in where its buffers are, so it is never streamed
+        with Metrics.stage("extractFeatures"):
+            pcmCache = getPcmCache()
 
-        #   If the max power of our analysis is greater than 10, we can assume it is more than just signal noise
-        #   and will add the power of any fundamentals to our notePresence dictionaries
-            if max(buffer.analysis) > 10:
-                appendNotePresence(buffer, track)
+            if pcmCache is not None:
+                data, sampleRate = pcmCache.read(track.filePath, contentHash, streamingAnalysis or partial)
+                appendTrackPresence(track, data, sampleRate, partial)
+            elif streamingAnalysis or partial:
+                with Ingest.StreamReader(track.filePath, getAnalysisRate(), analysisDtype) as source:
+                    appendTrackPresence(track, source, source.sampleRate, partial)
+            else:
+                data, sampleRate = Ingest.read(track.filePath, getAnalysisRate(), analysisDtype)
+                appendTrackPresence(track, data, sampleRate, partial)
 
-        assignTrackKeys(track)
+        Metrics.count("tracksAnalyzed")
+
+        if featureCache is not None:
+            featureCache.save(track, contentHash)
 
         return track
 
 
+def appendTrackPresence(track, monoData, sampleRate, partial = None):
+
+    #   Analyzes every buffer of a track's mono audio, which may be an array or an Ingest.StreamReader, adding the
+    #   power of its fundamentals to the track's notePresence dictionaries
+
+        track.duration      = len(monoData) / sampleRate
+        track.length        = getLength(track.duration)
+        track.halfwaySample = int(len(monoData) / 2)
+
+        samples = getBufferSamples(track.duration, sampleRate, partial)
+
+    #   An adaptive analysis visits buffers coarse to fine, and stops once the keys they point to are settled
+        if adaptiveAnalysis:
+            samples, firstPass = getCoarseToFineOrder(samples)
+            configuration = track.configuration or Analyzer.Configuration("Orchestral")
+            stableChecks  = 0
+            previousKeys  = None
+
+        #   Checks count the positions visited, as buffers too close to the edges of the track yield no Buffer
+            positions = {sample: i + 1 for i, sample in enumerate(samples)}
+            nextCheck = -(-firstPass // confidenceInterval) * confidenceInterval
+
+    #   A decoded track can be split into time ranges analyzed by separate threads, as the transforms release the GIL.
+    #   An adaptive analysis needs the buffers in order, and a stream can only be read by one thread at a time
+        elif analysisThreads > 1 and isinstance(monoData, np.ndarray) and len(samples) > analysisThreads:
+            appendThreadedPresence(track, monoData, sampleRate, samples, analysisThreads)
+            return
+
+    #   Iterate through the track
+        for buffer in getBuffers(monoData, sampleRate, samples, getSpectralBackend(track.genre)):
+            appendBufferPresence(buffer, track)
+
+            if adaptiveAnalysis and positions[buffer.sample] >= nextCheck:
+                nextCheck = (positions[buffer.sample] // confidenceInterval + 1) * confidenceInterval
+                keys = [calculateTonic(presence, configuration)
+                        for presence in (track.presence, track.startPresence, track.endPresence)]
+
+                stableChecks = stableChecks + 1 if keys == previousKeys else 0
+                previousKeys = keys
+
+                if stableChecks >= requiredStableChecks and getConfidence(track, configuration) >= confidenceThreshold:
+                    break
+
+
+def appendBufferPresence(buffer, track):
+
+    #   If the max power of our analysis is greater than 10, we can assume it is more than just signal noise
+    #   and will add the power of any fundamentals to our notePresence dictionaries
+
+        Metrics.count("buffersAnalyzed")
+        if max(buffer.analysis) > 10:
+            appendNotePresence(buffer, track)
+        else:
+            Metrics.count("buffersGated")
+
+
+def appendThreadedPresence(track, monoData, sampleRate, samples, threads):
+
+    #   Splits the buffers of a track into one contiguous time range per thread, each adding its notes' power to
+    #   presence dictionaries of its own, and adds those to the track's in the order of the ranges
+
+        ranges = [samples[i * len(samples) // threads : (i + 1) * len(samples) // threads] for i in range(threads)]
+
+        with ThreadPool(threads) as pool:
+            rangeTracks = pool.starmap(getRangePresence, [(track, monoData, sampleRate, samples) for samples in ranges])
+
+        for rangeTrack in rangeTracks:
+            for presenceName in TrackTable.presenceNames:
+                presence = getattr(track, presenceName)
+
+                for pitchClass, notePower in getattr(rangeTrack, presenceName).items():
+                    presence[pitchClass] += notePower
+
+
+def getRangePresence(track, monoData, sampleRate, samples):
+
+    #   Runs in a thread, analyzing the buffers at the given samples into a new Track's presence dictionaries
+
+        rangeTrack               = Track(track.filePath, track.extension, track.name)
+        rangeTrack.halfwaySample = track.halfwaySample
+
+        for buffer in getBuffers(monoData, sampleRate, samples, getSpectralBackend(track.genre)):
+            appendBufferPresence(buffer, rangeTrack)
+
+        return rangeTrack
+
+
+def getLength(seconds):
+    return str(int(seconds // 60)) + ":" + str(int(seconds % 60)).zfill(2)
+
+
+def getBufferSamples(seconds, sampleRate, partial = None):
+
+    #   Returns the samples at which buffers of a track are analyzed. A partial analysis only keeps the buffers of the
+    #   track's opening and closing partialEdgeSeconds, plus one buffer every partialStrideSeconds in between. Whether
+    #   the analysis is partial can be given, overriding partialAnalysis
+
+        sequencingIncrement = int(sequencingCoefficient * sampleRate)  # Time value to iterate by
+        bufferCount         = int(seconds / sequencingCoefficient)
+        samples             = [i * sequencingIncrement for i in range(0, bufferCount)]
+        partial             = partialAnalysis if partial is None else partial
+
+        if partial:
+            edgeBuffers   = int(partialEdgeSeconds / sequencingCoefficient)
+            strideBuffers = max(1, int(partialStrideSeconds / sequencingCoefficient))
+
+            samples = [sample for i, sample in enumerate(samples)
+                       if i < edgeBuffers or i >= bufferCount - edgeBuffers or i % strideBuffers == 0]
+
+        return samples
+
+
+def comparePartialAnalysis(tracks):
+
+    #   Analyzes the given tracks both fully and partially, reporting how often the partial analysis finds the same
+    #   keys as the full one, along with how long each took. Tracks must have a configuration and genre
+
+        agreements = {"startKey": 0, "endKey": 0, "easyKey": 0}
+        durations  = {"full": 0.0, "partial": 0.0}
+
+        for track in tracks:
+            keys = {}
+
+            for mode in ("full", "partial"):
+                analyzedTrack               = Track(track.filePath, track.extension, track.name)
+                analyzedTrack.configuration = track.configuration
+                analyzedTrack.genre         = track.genre
+
+                timer = time.perf_counter()
+                analyzeTrack(analyzedTrack, partial = mode == "partial")
+                durations[mode] += time.perf_counter() - timer
+
+                keys[mode] = analyzedTrack
+
+            agreements["startKey"] += keys["full"].startKey.tonic == keys["partial"].startKey.tonic
+            agreements["endKey"]   += keys["full"].endKey.tonic   == keys["partial"].endKey.tonic
+            agreements["easyKey"]  += keys["full"].easyKey        == keys["partial"].easyKey
+
+        report = {keyName + "Agreement": round(agreement / max(1, len(tracks)), 4) for keyName, agreement in agreements.items()}
+        report["fullSeconds"]    = round(durations["full"], 2)
+        report["partialSeconds"] = round(durations["partial"], 2)
+        report["speedup"]        = round(durations["full"] / durations["partial"], 2) if durations["partial"] else None
+
+        return report
+
+
+def getAnalysisSettings():
+
+    #   Returns the current values of the analysisSettings, to be applied in a worker process with setAnalysisSettings
+
+        return {name: globals()[name] for name in analysisSettings}
+
+
+def setAnalysisSettings(settings):
+    globals().update(settings)
+
+
+def getAnalysisParameters():
+
+    #   Returns the parameters that extracted features depend on, used to invalidate cached features
+
+        return {"stuttgartPitch"        : stuttgartPitch,
+                "overlapCoefficient"    : overlapCoefficient,
+                "sequencingCoefficient" : sequencingCoefficient,
+                "increments"            : increments,
+                "segmentSize"           : segmentSize,
+                "analysisRate"          : getAnalysisRate(),
+                "analysisDtype"         : np.dtype(analysisDtype).name,
+                "spectralBackends"      : spectralBackends,
+                "fftBackend"            : fftBackend,
+                "filterbank"            : [Spectrum.filterbankFrameSize, Spectrum.filterbankBandwidth],
+                "partialAnalysis"       : [partialEdgeSeconds, partialStrideSeconds] if partialAnalysis else None,
+                "adaptiveAnalysis"      : [coarseBuffers, confidenceInterval, requiredStableChecks,
+                                           confidenceThreshold] if adaptiveAnalysis else None}
+
+
 def convertToMono(trackData):
 
-    #   Converts a track to mono for FFT analysis
+    #   Converts a track to mono for FFT analysis, summing all of its channels
 
-        monoData = np.empty(len(trackData), dtype=np.float64)
-        for i in range(0, len(trackData)):
-            frame = trackData[i]
+        return Ingest.downmix(trackData)
 
-        #   The always_2d parameter seems to be bugged, so we have to check ourselves
-            if len(frame) > 1:
-                monoData[i] = frame[0] + frame[1]
-            else:
-                monoData[i] = frame[0]
 
-        return monoData
+def getAnalysisRate():
 
+    #   Returns the sample rate tracks are resampled to before analysis, or None if they are analyzed at their own rate.
+    #   Buffer.binSize maps bin i of an analysis to i * 2 * sampleRate / segmentSize hertz, so a note's bin range stays
+    #   inside the analysis as long as the sample rate exceeds its upper threshold. The analysis rate is the lowest
+    #   standard rate that keeps the highest overtone of every fundamental in range
 
-def getSegmentAnalyses(monoData, sample):
+        if not resampling:
+            return None
 
-    #   Using a sample size of half a second, apply a blackman-harris window and zero-padded FFT operation on
-    #   100 segments before and after current sample, with an overlap of 66.1%. The segments are then averaged
-    #   into one analysis. The windowing and smoothing helps to refine results and reduce spectral leakage
+        highestFrequency = max(overtone.getAdjacent(1).frequency for note in fundamentalNotes
+                                                                  for overtone in note.getOvertones())
 
-        segmentStart = sample - overlapOffset
+        return min(rate for rate in standardRates if rate > highestFrequency)
 
-        #segments = np.empty(increments, dtype=object)
-        analyses = []
 
-        for i in range(0, increments):
-            #   Since the smoothing operation grabs samples before and after a given point, we must omit segments that
-            #   exceed the outer bounds of our data
-            if segmentStart < 0 or segmentStart + segmentIncrement > len(monoData):
-                segmentStart += segmentIncrement
-                continue
+def getBuffers(monoData, sampleRate, samples, backend = "fft"):
 
-            analyses.append(analyzeSegment(monoData[segmentStart : segmentStart + segmentSize]))
-            segmentStart += segmentIncrement
+    #   Yields a Buffer for each of the given samples, transforming the segments of buffersPerBatch buffers at a time
+    #   with a shared Stft so that every unique segment is windowed and transformed only once. The mono data may be
+    #   an array or an Ingest.StreamReader, as it is only sliced one batch region at a time. The filterbank backend
+    #   measures the same segments with a NoteFilterbank instead, decimating an array once rather than every region
+
+        if backend == "filterbank":
+            yield from getFilterbankBuffers(monoData, sampleRate, samples)
+            return
+
+        stft = Spectrum.Stft(blackmanWindow, backend=fftBackend, workers=fftWorkers)
+
+        for batch in getBatches(samples):
+            segmentStarts = [getSegmentStarts(sample, len(monoData)) for sample in batch]
+
+        #   Only the region of the track covered by the batch's segments is needed
+            starts      = [start for bufferStarts in segmentStarts for start in bufferStarts]
+            regionStart = min(starts, default=0)
+            region      = monoData[regionStart : max(starts, default=-segmentSize) + segmentSize]
+
+            with Metrics.stage("fft"):
+                analyses = stft.getAnalyses(region, regionStart, segmentStarts)
+
+            for sample, analysis in zip(batch, analyses):
+
+            #   Buffers too close to the edges of the track to hold any segment carry no analysis
+                if analysis is None:
+                    continue
+
+            #   Collect the DC offset (zero-frequency) and remove it to make the array length coincide with samples / 2
+                yield Buffer(analysis[1:], analysis[0], sampleRate, sample)
+
+
+def getFilterbankBuffers(monoData, sampleRate, samples):
+
+    #   Yields a Buffer of note filterbank band powers for each of the given samples
+
+        filterbank = getNoteFilterbank(sampleRate)
+        levels     = None
+
+        if isinstance(monoData, np.ndarray):
+            with Metrics.stage("filterbank"):
+                levels = filterbank.getLevels(monoData)
+
+        for batch in getBatches(samples):
+            segmentStarts = [getSegmentStarts(sample, len(monoData)) for sample in batch]
+            starts        = [start for bufferStarts in segmentStarts for start in bufferStarts]
+
+            with Metrics.stage("filterbank"):
+                if levels is not None:
+                    analyses = filterbank.getAnalyses(levels, 0, segmentStarts)
+                else:
+                    regionStart = min(starts, default=0)
+                    region      = monoData[regionStart : max(starts, default=-segmentSize) + segmentSize]
+                    analyses    = filterbank.getAnalyses(filterbank.getLevels(region), regionStart, segmentStarts)
+
+            for sample, analysis in zip(batch, analyses):
+                if analysis is not None:
+                    yield Buffer(analysis, 0.0, sampleRate, sample, filterbank)
+
+
+def getPcmCache():
+
+    #   Returns the PcmCache of the current ingest parameters, or None if decoded audio isn't cached
+
+        if pcmCacheDirectory is None:
+            return None
+
+        parameters = (pcmCacheDirectory, getAnalysisRate(), np.dtype(analysisDtype).name, pcmCacheSize)
+        if parameters not in pcmCaches:
+            pcmCaches[parameters] = PcmCache.PcmCache(pcmCacheDirectory, getAnalysisRate(), analysisDtype, pcmCacheSize)
+
+        return pcmCaches[parameters]
+
+
+def getSpectralBackend(genre):
+    return spectralBackends.get(genre, "fft")
+
+
+def getCoarseToFineOrder(samples):
+
+    #   Reorders buffer samples so that a first pass spreads about coarseBuffers buffers evenly across the track, and
+    #   every following pass halves the spacing between visited buffers. Returns the samples and the size of the
+    #   first pass
+
+        stride = 1 << max(0, (len(samples) // coarseBuffers).bit_length() - 1)
+        order  = list(range(0, len(samples), stride))
+        first  = len(order)
 
-        return analyses
+        while stride > 1:
+            order  += list(range(stride // 2, len(samples), stride))
+            stride //= 2
 
+        return [samples[i] for i in order], first
 
-def analyzeSegment(segment):
 
-    #   Takes a set of segmentSize samples, applies a blackman harris window, and returns the realized FFT'd output
+def getBatches(samples):
 
-    #   Apply blackman-harris window function
-        segment *= blackmanWindow
+    #   Splits buffer samples into batches of at most buffersPerBatch buffers. A batch also ends wherever buffers are
+    #   more than a segment apart, or go back in the track as a coarse to fine order does between passes, so that the
+    #   region a batch covers never spans a part of the track that is skipped
 
-    #   Perform zero-padded FFT on the segment, convert the complex output to real, and get the absolute value
-        spectrumData = np.fft.rfft(segment)
-        spectrumData = np.absolute(np.real(spectrumData))
+        batch = []
 
-        return spectrumData
+        for sample in samples:
+            if len(batch) == buffersPerBatch or (batch and not 0 < sample - batch[-1] <= segmentSize):
+                yield batch
+                batch = []
+
+            batch.append(sample)
+
+        if batch:
+            yield batch
+
+
+def getSegmentStarts(sample, dataLength):
+
+    #   Returns the starting samples of the segments surrounding a given sample: half-second segments before and after
+    #   it, with an overlap of 66.1%, which getBuffers windows, transforms and averages into one analysis. The windowing
+    #   and smoothing helps to refine results and reduce spectral leakage
+
+        segmentStart  = sample - overlapOffset
+        segmentStarts = []
+
+        for i in range(0, increments):
+            #   Since the smoothing operation grabs samples before and after a given point, we must omit segments that
+            #   exceed the outer bounds of our data
+            if segmentStart >= 0 and segmentStart + segmentIncrement <= dataLength:
+                segmentStarts.append(segmentStart)
+
+            segmentStart += segmentIncrement
+
+        return segmentStarts
 
 
 def appendNotePresence(buffer, track):
@@ -249,67 +594,89 @@ def appendNotePresence(buffer, track):
     #   in the buffer's analysis are fundamental tones, adding their powers to the
     #   respective note of the dictionary if they are
 
-        average = sum(buffer.analysis) / len(buffer.analysis)
+        with Metrics.stage("notePower"):
+            engine = buffer.engine or getNotePowerEngine(buffer)
+            fundamentals, powers = engine.getFundamentals(buffer.analysis)
+
+        #   If 10 or more overtones of a peak show considerable power, the note is likely a fundamental
+        #   Add its power to the note presence dictionary, as well as the starting and ending dictionaries
+            for noteIndex, notePower in zip(fundamentals, powers):
+                pitchClass = engine.notes[noteIndex].pitchClass
+
+                track.presence[pitchClass] += notePower
+                if buffer.sample < track.halfwaySample:
+                    track.startPresence[pitchClass] += notePower
+                else:
+                    track.endPresence[pitchClass]   += notePower
 
-        for noteName in noteDictionary:
-            note = noteDictionary[noteName]
 
-            #   Power above the 6th octave is unlikely to be that of a fundamental's
-            if note.octave >= 6:
-                continue
+def getNotePowerEngine(buffer):
 
-            notePower = note.getPower(buffer)
+    #   Returns the note power engine matching the bin layout of a buffer, building it the first time it is needed
 
-        #   check adjacent notes to see if current note is a peak
-            neighborPowers = []
-            neighborPowers.append(note.getAdjacent( 1).getPower(buffer))
-            neighborPowers.append(note.getAdjacent(-1).getPower(buffer))
+        layout = (buffer.sampleRate, len(buffer.analysis))
 
-        #   If the note's power is greater than that of its neighbors, a peak has been detected
-            if notePower > max(neighborPowers):
-                overtones = note.getOvertones()
+        if layout not in noteEngines:
+            noteEngines[layout] = Spectrum.NotePowerEngine(fundamentalNotes, buffer.binSize, len(buffer.analysis))
 
-                validOvertones = 0
+        return noteEngines[layout]
 
-            #   Iterate through all overtones of the note, increasing score for those that appear to be significant
-                for overtone in overtones:
-                    overtoneNeighborPowers = []
-                    overtoneNeighborPowers.append(overtone.getAdjacent( 1).getPower(buffer))
-                    overtoneNeighborPowers.append(overtone.getAdjacent(-1).getPower(buffer))
 
-                    overtonePower = overtone.getPower(buffer)
-                    if overtonePower > max(overtoneNeighborPowers) or (overtonePower > average and overtonePower > max(overtoneNeighborPowers) * 0.8):
-                        validOvertones += 1
+def getNoteFilterbank(sampleRate):
 
-            #   If 10 or more overtones of the given note show considerable power, the note is likely a fundamental
-            #   Add its power to the note presence dictionary, as well as the starting and ending dictionaries
-                if validOvertones >= 10:
-                    track.presence[note.pitchClass] += notePower
-                    if buffer.sample < track.halfwaySample:
-                        track.startPresence[note.pitchClass] += notePower
-                    else:
-                        track.endPresence[note.pitchClass]   += notePower
+    #   Returns the note filterbank for a sample rate, building it the first time it is needed
+
+        if sampleRate not in noteFilterbanks:
+            noteFilterbanks[sampleRate] = Spectrum.NoteFilterbank(fundamentalNotes, sampleRate, segmentSize)
+
+        return noteFilterbanks[sampleRate]
 
 
 def assignTrackKeys(track):
 
     #   Identifies and assigns the key(s) of a track
 
-        generalTonic = calculateTonic(track.presence, track.configuration)
-        generalMode  = getMode(generalTonic, track.presence)
+        with Metrics.stage("tonic"):
+            generalTonic = calculateTonic(track.presence, track.configuration)
+            generalMode  = getMode(generalTonic, track.presence)
 
-        startTonic = calculateTonic(track.startPresence, track.configuration)
-        endTonic   = calculateTonic(track.endPresence  , track.configuration)
+            startTonic = calculateTonic(track.startPresence, track.configuration)
+            endTonic   = calculateTonic(track.endPresence  , track.configuration)
+
+            if track.genre == "Pop" or startTonic == endTonic:
+                track.startKey = Key(generalTonic, generalMode)
+                track.endKey   = Key(generalTonic, generalMode)
+                track.easyKey  = generalTonic
+
+            else:
+                track.startKey = Key(startTonic, getMode(startTonic, track.startPresence))
+                track.endKey   = Key(endTonic  , getMode(endTonic  , track.endPresence))
+                track.easyKey = startTonic + " - " + endTonic
+
+            track.confidence = getConfidence(track, track.configuration)
+
+
+def getConfidence(track, configuration):
+
+    #   Returns how clearly a track's presences point to the keys assignTrackKeys gives it, as the margin between the
+    #   best and runner-up tonic scores relative to the best score. Modulating tracks take the lower margin of halves
+
+        startTonic = calculateTonic(track.startPresence, configuration)
+        endTonic   = calculateTonic(track.endPresence  , configuration)
 
         if track.genre == "Pop" or startTonic == endTonic:
-            track.startKey = Key(generalTonic, generalMode)
-            track.endKey   = Key(generalTonic, generalMode)
-            track.easyKey  = generalTonic
+            return getTonicMargin(track.presence, configuration)
 
-        else:
-            track.startKey = Key(startTonic, getMode(startTonic, track.startPresence))
-            track.endKey   = Key(endTonic  , getMode(endTonic  , track.endPresence))
-            track.easyKey = startTonic + " - " + endTonic
+        return min(getTonicMargin(track.startPresence, configuration), getTonicMargin(track.endPresence, configuration))
+
+
+def getTonicMargin(presence, configuration):
+
+    #   Returns the margin between the two highest tonic scores of a presence, relative to the highest
+
+        scores = np.sort(Analyzer.scoreTonalities([presence[note] for note in chromaticScale], configuration.toArray())[0, 0])
+
+        return float((scores[-1] - scores[-2]) / abs(scores[-1])) if scores[-1] else 0.0
 
 
 def calculateTonic(presence, configuration):
@@ -317,30 +684,38 @@ def calculateTonic(presence, configuration):
     #   Takes an array of note presences and uses the given configuration to estimate the tonal center of the data
     #   Notes' final scores will be scaled relatively to their power level relative to the principal power (max power)
 
-        noteScores = {}
+        scores = Analyzer.scoreTonalities([presence[note] for note in chromaticScale], configuration.toArray())
+
+        return chromaticScale[Analyzer.getTonics(scores)[0, 0]]
+
 
-        for note in presence:
-            tonalityScorer = Analyzer.TonalityScorer(presence, note, configuration)
+def getTrackTonics(tracks, configurations, genre):
+
+    #   Matrix form of assignTrackKeys, identifying the tonics of many tracks under many configurations at once.
+    #   Returns the (configurations x tracks) indices of the starting and ending tonics of every track
+
+        coefficients = np.array([configuration.toArray() for configuration in configurations])
+        tonics       = []
+
+    #   A TrackTable already holds the presences of its tracks as a (tracks x 3 x 12) cube
+        if isinstance(tracks, TrackTable.TrackTable):
+            presenceCube = tracks.presences
+        else:
+            presenceCube = np.array([[[getattr(track, presenceName)[note] for note in chromaticScale]
+                                      for presenceName in TrackTable.presenceNames] for track in tracks]).reshape(-1, 3, 12)
 
-            score = 0
+        for i in range(len(TrackTable.presenceNames)):
+            tonics.append(Analyzer.getTonics(Analyzer.scoreTonalities(presenceCube[:, i], coefficients)))
 
-            score += tonalityScorer.significance()
-            score += tonalityScorer.dominantRelationship()
-            score += tonalityScorer.dominantSubdominantRelationship()
-            score += tonalityScorer.minorRelativeRelationship()
-            score += tonalityScorer.majorRelativeRelationship()
-            score += tonalityScorer.triadicRelationship()
-            score += tonalityScorer.leadingToneRelationship()
-            score += tonalityScorer.tritoneRelationship()
-            score += tonalityScorer.phrygianRelationship()
-            score += tonalityScorer.diatonicRelationship()
+        generalTonics, startTonics, endTonics = tonics
 
-            noteScores[note] = round(score * 10, 2)
+    #   Tracks that do not modulate take their general tonic as both their starting and ending tonic
+        if genre == "Pop":
+            return generalTonics, generalTonics
 
-    #   Order the notes by score to retrieve the highest scoring note
-        noteScores = dict(sorted(noteScores.items(), key=lambda x: x[1], reverse=True))
+        unmodulated = startTonics == endTonics
 
-        return list(noteScores.keys())[0]
+        return np.where(unmodulated, generalTonics, startTonics), np.where(unmodulated, generalTonics, endTonics)
 
 
 def getMode(note, presence):
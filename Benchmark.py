@@ -0,0 +1,400 @@
+import Playlists
+import App
+import Analyzer
+import Metrics
+import Spectrum
+import TrackTable
+import argparse
+import json
+import multiprocessing
+import numpy as np
+import os
+import random
+import soundfile as sf
+import statistics
+import subprocess
+import sys
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+playlistSizes = [1000, 10000, 100000, 1000000]
+batchLibrary  = 10000  # Tracks in the library of the batch benchmark
+batchRequests = 1000   # Playlists built by the batch benchmark
+batchSize     = 50     # Tracks in each playlist of the batch benchmark
+optimizeSizes = [100, 1000, 10000]
+budgets       = [0.1, 1, 10]  # Seconds given to optimizePlaylist by the optimize benchmark
+
+#   Synthetic tracks of the analysis benchmark: name, tonic of each half, mode, length in seconds, sample rate, channels
+syntheticTracks = [("C-major",         ["C"],         "major",  30, 44100, 2),
+                   ("A-minor",         ["A"],         "minor",  30, 44100, 1),
+                   ("D-to-A-major",    ["D",  "A"],   "major",  60, 48000, 2),
+                   ("F#-minor-long",   ["F#"],        "minor", 150, 22050, 1),
+                   ("D#-to-A#-major",  ["D#", "A#"],  "major",  45, 96000, 2),
+                   ("G-major-surround",["G"],         "major",  30, 44100, 6),
+                   ("E-to-B-minor",    ["E",  "B"],   "minor",  40, 32000, 1)]
+
+chordSeconds = 2   # Length of each chord of the synthetic progressions
+overtones    = 12  # Harmonics of each synthetic tone, with amplitudes falling as 1 / n
+
+#   Semitones above the tonic of the notes of a I - IV - V - I progression, the minor V borrowing the leading tone
+progressions = {"major" : [(0, 4, 7), (5, 9, 12), (7, 11, 14), (0, 4, 7)],
+                "minor" : [(0, 3, 7), (5, 8, 12), (7, 11, 14), (0, 3, 7)]}
+
+stageNames = ("decode", "fft", "filterbank", "notePower", "tonic")  # Metrics stages reported by the analysis benchmark
+
+#   Commands whose cold start is timed by the startup benchmark, each run in a fresh interpreter startupRuns times
+startupCommands = {"CLI --help"            : ["CLI.py", "--help"],
+                   "import App"            : ["-c", "import App"],
+                   "import MachineLearner" : ["-c", "import MachineLearner"]}
+startupRuns     = 5
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def main():
+
+    #   Runs the benchmark named on the command line
+
+        parser = argparse.ArgumentParser(description = "Benchmarks of the Musical Playlists pipeline")
+        parser.add_argument("benchmark", choices = sorted(benchmarks))
+        parser.add_argument("--sizes", type = int, nargs = "+", default = playlistSizes)
+        parser.add_argument("--seed",  type = int, default = 0)
+        parser.add_argument("--processes", type = int, nargs = "+", default = [1, None])
+        parser.add_argument("--threads",   action = "store_true")
+        parser.add_argument("--table",     action = "store_true", help = "build playlists from a TrackTable of the tracks")
+        parser.add_argument("--directory", default = "BenchmarkTracks", help = "folder of the synthetic tracks")
+        parser.add_argument("--baseline",  default = str(Path(__file__).with_name("BenchmarkBaseline.json")),
+                            help = "JSON file of the keys the analysis benchmark must keep detecting")
+        parser.add_argument("--update-baseline", action = "store_true", help = "write the detected keys to --baseline")
+        parser.add_argument("--backend",   choices = ("fft", "filterbank"), help = "spectral backend of the analysis")
+        parser.add_argument("--fft-backend", choices = ("numpy", "scipy"), help = "library of the fft backend")
+        parser.add_argument("--fft-workers", type = int, help = "threads of each scipy transform")
+        parser.add_argument("--float32",   action = "store_true", help = "analyze in single precision")
+        parser.add_argument("--analysis-threads", type = int, help = "threads analyzing each track")
+
+        arguments = parser.parse_args()
+        benchmarks[arguments.benchmark](arguments)
+
+
+def benchmarkPlaylist(arguments):
+
+    #   Times buildPlaylist on libraries of increasing size. Near-constant time per track means near-linear scaling
+
+        for size in arguments.sizes:
+            tracks = makeLibrary(size, arguments)
+
+            random.seed(arguments.seed)
+            timer    = time.perf_counter()
+            playlist = Playlists.buildPlaylist(tracks)
+            seconds  = time.perf_counter() - timer
+
+            assert len(playlist) == size
+
+            print("{0:>9} tracks  {1:9.2f} s  {2:7.2f} us/track".format(size, seconds, seconds / size * 1e6))
+
+
+def benchmarkBatch(arguments):
+
+    #   Measures the throughput of buildPlaylists, in playlists per second, for each number of worker processes (or
+    #   threads), and checks that every run returns the same playlists
+
+        library  = makeLibrary(batchLibrary, arguments)
+        requests = [Playlists.PlaylistRequest(arguments.seed + i, batchSize) for i in range(batchRequests)]
+        expected = None
+
+        for processes in arguments.processes:
+            timer     = time.perf_counter()
+            playlists = Playlists.buildPlaylists(library, requests, processes, arguments.threads)
+            seconds   = time.perf_counter() - timer
+
+            playlists = [[id(track) for track in playlist] for playlist in playlists]
+            expected  = expected or playlists
+            assert playlists == expected
+
+            print("{0:>9} workers  {1:9.2f} s  {2:9.1f} playlists/s".format(str(processes or "all"), seconds,
+                                                                           len(requests) / seconds))
+
+
+def benchmarkOptimize(arguments):
+
+    #   Compares the total transition score of greedy playlists with that of the same playlists after optimizePlaylist,
+    #   for increasing time budgets
+
+        for size in optimizeSizes:
+            tracks = makeAnalyzedTracks(size, arguments.seed)
+            greedy = Playlists.buildPlaylist(tracks, random.Random(arguments.seed), seconds = 0)
+            score  = Playlists.scorePlaylist(greedy)
+
+            print("{0:>9} tracks  greedy {1:12.2f}".format(size, score))
+
+            for seconds in budgets:
+                optimized = Playlists.optimizePlaylist(greedy, seconds, random.Random(arguments.seed))
+
+                print("{0:>9} s       score  {1:12.2f}  {2:+7.2%}".format(seconds, Playlists.scorePlaylist(optimized),
+                                                                         Playlists.scorePlaylist(optimized) / score - 1))
+
+
+def benchmarkAnalysis(arguments):
+
+    #   Analyzes synthetic tracks in known keys, reporting the throughput (seconds of audio analyzed per CPU second),
+    #   peak memory use and detected keys of each, and the key accuracy over all of them. Each track is analyzed in a
+    #   fresh process so that its peak memory use is its own. With a baseline, the run fails if any detected key differs
+    #   from the baseline's, so that optimizations cannot silently change results. The baseline holds the keys of the
+    #   tracks synthesized with seed 0, so it is neither checked nor updated with another seed
+
+        paths   = makeSyntheticTracks(arguments.directory, arguments.seed)
+        results = {}
+
+        if arguments.backend is not None:
+            App.spectralBackends[App.genre] = arguments.backend
+        if arguments.fft_backend is not None:
+            App.fftBackend = arguments.fft_backend
+        if arguments.fft_workers is not None:
+            App.fftWorkers = arguments.fft_workers
+        if arguments.float32:
+            App.analysisDtype = np.float32
+        if arguments.analysis_threads is not None:
+            App.analysisThreads = arguments.analysis_threads
+
+        flops, frameBytes = estimateBufferCost(App.getSpectralBackend(App.genre), 44100)
+        print("{0} backend: about {1:.1f} MFLOP and {2:.1f} MB of frames and spectra per buffer at 44.1 kHz".format(
+              App.getSpectralBackend(App.genre), flops / 1e6, frameBytes / 1e6))
+
+        with Pool(1, maxtasksperchild = 1) as pool:
+            settings = App.getAnalysisSettings()
+            analyses = pool.imap(analyzeSyntheticTrack, [(path, settings) for path in paths])
+
+            for (name, tonics, mode, seconds, sampleRate, channels), result in zip(syntheticTracks, analyses):
+                results[name] = result
+
+                stages = "  ".join("{0} {1:5.2f} s".format(stage, result["stages"][stage]) for stage in stageNames)
+                print("{0:<18} {1:>4} s {2:>6} Hz {3} ch  {4:7.1f} x  {5:7.1f} MB  {6:<8} -> {7:<8}  {8}".format(
+                      name, seconds, sampleRate, channels, seconds / result["cpuSeconds"], result["peakMemory"],
+                      result["startKey"], result["endKey"], stages))
+
+    #   A track's key is correct if the tonics of both its halves are
+        tonicsCorrect = [results[name]["startKey"].split()[0] == tonics[0] and results[name]["endKey"].split()[0] == tonics[-1]
+                         for name, tonics, *_ in syntheticTracks]
+        modesCorrect  = [results[name]["startKey"].split()[1] == mode for name, tonics, mode, *_ in syntheticTracks]
+
+        audioSeconds = sum(track[3] for track in syntheticTracks)
+        cpuSeconds   = sum(result["cpuSeconds"] for result in results.values())
+
+        print("throughput {0:.1f} audio s / CPU s, peak memory {1:.1f} MB, tonic accuracy {2:.0%}, mode accuracy {3:.0%}"
+              .format(audioSeconds / cpuSeconds, max(result["peakMemory"] for result in results.values()),
+                      np.mean(tonicsCorrect), np.mean(modesCorrect)))
+
+        timer    = time.perf_counter()
+        playlist = Playlists.buildPlaylist([makeResultTrack(name, result) for name, result in results.items()])
+        print("buildPlaylist {0:.2f} ms".format((time.perf_counter() - timer) * 1e3))
+
+        if arguments.baseline and arguments.seed != 0:
+            print("Baseline skipped, as it holds the keys of the tracks synthesized with seed 0")
+
+        elif arguments.baseline:
+            keys = {name: {"startKey": result["startKey"], "endKey": result["endKey"]} for name, result in results.items()}
+
+            if arguments.update_baseline:
+                with open(arguments.baseline, "w") as file:
+                    json.dump(keys, file, indent = 4)
+
+            else:
+                with open(arguments.baseline) as file:
+                    baseline = json.load(file)
+
+                changes = [name for name in baseline if keys.get(name) != baseline[name]]
+                for name in changes:
+                    print("REGRESSION {0}: {1} instead of {2}".format(name, keys.get(name), baseline[name]))
+
+                if changes:
+                    sys.exit(1)
+
+
+def estimateBufferCost(backend, sampleRate):
+
+    #   Returns the floating point operations and bytes of frames and spectra a spectral backend needs per buffer,
+    #   counting 2.5 n log2 n operations per real FFT of size n
+
+        itemSize = np.dtype(App.analysisDtype).itemsize
+
+        if backend == "filterbank":
+            filterbank = App.getNoteFilterbank(sampleRate)
+            frameSize  = filterbank.frameSize
+
+            flops = App.increments * filterbank.levels * 2.5 * frameSize * np.log2(frameSize)
+            flops += 2 * len(filterbank.kernelWeights)
+
+        #   Decimation is done once per track, so each buffer accounts for the samples between buffers
+            newSamples = App.sequencingCoefficient * sampleRate
+            flops += sum(2 * len(Spectrum.halfbandFilter) * newSamples / 2 ** level for level in range(filterbank.levels - 1))
+
+            return flops, App.increments * filterbank.levels * (frameSize + frameSize // 2 + 1) * 8
+
+        return (App.increments * 2.5 * App.segmentSize * np.log2(App.segmentSize),
+                App.increments * (App.segmentSize + App.segmentSize // 2 + 1) * itemSize)
+
+
+def analyzeSyntheticTrack(task):
+
+    #   Runs in a fresh worker process, analyzing a track with the analysis settings of the benchmark and returning its
+    #   keys, CPU time, peak memory use and the time spent in each of the stageNames. resource is only imported here, as
+    #   it doesn't exist on Windows
+
+        import resource
+
+        path, settings = task
+
+        App.setAnalysisSettings(settings)
+        Metrics.enabled = True
+
+        track               = App.Track(str(path), path.suffix[1:], path.stem)
+        track.configuration = Analyzer.Configuration("Orchestral")
+        track.genre         = App.genre
+
+        timer = time.process_time()
+        App.analyzeTrack(track)
+        cpuSeconds = time.process_time() - timer
+        stages     = Metrics.getSnapshot()["stages"]
+
+        return {"startKey"   : track.startKey.tonic + " " + track.startKey.mode,
+                "endKey"     : track.endKey.tonic   + " " + track.endKey.mode,
+                "cpuSeconds" : cpuSeconds,
+                "peakMemory" : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                "stages"     : {name: stages[name]["cpuSeconds"] for name in stageNames}}
+
+
+def benchmarkStartup(arguments):
+
+    #   Times the cold start of the startupCommands, and how long a pool of worker processes takes to be ready to
+    #   analyze with each start method, each worker importing the analysis modules (unless forked from this process)
+    #   and building the note tables of a bin layout. Worker CPU time is that of the worker's whole process
+
+        for name, command in startupCommands.items():
+            durations = []
+            for run in range(startupRuns):
+                timer = time.perf_counter()
+                subprocess.run([sys.executable] + command, cwd = Path(__file__).parent, check = True,
+                               stdout = subprocess.DEVNULL)
+                durations.append(time.perf_counter() - timer)
+
+            print("{0:<22} {1:7.1f} ms median  {2:7.1f} ms best".format(name, statistics.median(durations) * 1e3,
+                                                                       min(durations) * 1e3))
+
+        for method in multiprocessing.get_all_start_methods():
+            for processes in arguments.processes:
+                processes = processes or os.cpu_count()
+
+                timer = time.perf_counter()
+                with multiprocessing.get_context(method).Pool(processes) as pool:
+                    workers = dict(pool.map(startWorker, [44100] * processes, chunksize = 1))
+                seconds = time.perf_counter() - timer
+
+                print("{0:<11} {1:>4} workers  {2:7.1f} ms until ready  {3:7.1f} ms CPU per worker".format(
+                      method, processes, seconds * 1e3, np.mean(list(workers.values())) * 1e3))
+
+
+def startWorker(sampleRate):
+
+    #   Runs in a worker process, returning its process id and CPU time once it can analyze tracks of a sample rate
+
+        App.getNotePowerEngine(App.Buffer(np.zeros(App.segmentSize // 2), 0.0, sampleRate, 0))
+
+        return os.getpid(), time.process_time()
+
+
+def makeResultTrack(name, result):
+    track = App.Track("", "", name)
+
+    track.startKey = App.Key(*result["startKey"].split())
+    track.endKey   = App.Key(*result["endKey"].split())
+    track.easyKey  = track.startKey.tonic
+
+    return track
+
+
+def makeSyntheticTracks(directory, seed = 0):
+
+    #   Writes the syntheticTracks to a folder, unless they are already there, and returns their paths
+
+        directory = Path(directory)
+        directory.mkdir(parents = True, exist_ok = True)
+
+        paths = []
+        for i, (name, tonics, mode, seconds, sampleRate, channels) in enumerate(syntheticTracks):
+            path = directory / (name + "-" + str(seed) + ".wav")
+            if not path.exists():
+                writeSyntheticTrack(path, tonics, mode, seconds, sampleRate, channels, seed + i)
+
+            paths.append(path)
+
+        return paths
+
+
+def writeSyntheticTrack(path, tonics, mode, seconds, sampleRate, channels, seed = 0):
+
+    #   Writes a track repeating a I - IV - V - I progression of overtone-rich tones in the key of each tonic in turn,
+    #   with a bass note under each chord and a little noise, one chord at a time
+
+        rng          = np.random.default_rng(seed)
+        chordSamples = chordSeconds * sampleRate
+        chords       = int(seconds / chordSeconds)
+        times        = np.arange(chordSamples) / sampleRate
+
+        with sf.SoundFile(str(path), "w", sampleRate, channels, "PCM_16") as file:
+            for i in range(chords):
+                tonic  = App.chromaticScale.index(tonics[i * len(tonics) // chords])
+                chord  = progressions[mode][i % len(progressions[mode])]
+                signal = rng.normal(0, 0.001, chordSamples)
+
+            #   Chord tones from the third octave, and the bass an octave below the chord's root
+                for step in chord + (chord[0] - 12,):
+                    frequency = App.stuttgartPitch * 2 ** ((tonic + step - 9) / 12 - 1)
+
+                    for overtone in range(1, overtones + 1):
+                        if frequency * overtone < sampleRate / 2:
+                            signal += np.sin(2 * np.pi * frequency * overtone * times) / overtone * 0.04
+
+                file.write(np.repeat(signal[:, np.newaxis], channels, axis = 1) * (0.5 if channels > 1 else 1))
+
+        return path
+
+
+def makeLibrary(count, arguments):
+    tracks = makeAnalyzedTracks(count, arguments.seed)
+
+    return TrackTable.TrackTable.fromTracks(tracks) if arguments.table else tracks
+
+
+def makeAnalyzedTracks(count, seed = 0):
+
+    #   Returns tracks with random keys, a tenth of which modulate between their halves
+
+        rng    = random.Random(seed)
+        tracks = []
+
+        for i in range(count):
+            track = App.Track("", "", "Track " + str(i))
+
+            track.startKey = App.Key(rng.choice(App.chromaticScale), rng.choice(("major", "minor")))
+            track.endKey   = App.Key(track.startKey.tonic, track.startKey.mode)
+            if rng.random() < 0.1:
+                track.endKey = App.Key(rng.choice(App.chromaticScale), rng.choice(("major", "minor")))
+
+            track.easyKey = track.startKey.tonic
+            tracks.append(track)
+
+        return tracks
+
+
+benchmarks = {"playlist" : benchmarkPlaylist,
+              "batch"    : benchmarkBatch,
+              "optimize" : benchmarkOptimize,
+              "analysis" : benchmarkAnalysis,
+              "startup"  : benchmarkStartup}
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+if __name__ == '__main__':
+    main()
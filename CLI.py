@@ -0,0 +1,191 @@
+import argparse
+
+#   Modules are imported by the command that needs them, so that starting a command (or a worker process that imports
+#   this module as its main module) only pays for what it uses
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def main(argv = None):
+
+    #   Runs the command named on the command line. Unlike App.main, every command takes its tracks as paths, so that
+    #   none needs a display
+
+        parser   = argparse.ArgumentParser(description = "Identify the keys of tracks and order them into playlists")
+        commands = parser.add_subparsers(dest = "command", required = True)
+
+        analyze = commands.add_parser("analyze", help = "identify the keys of tracks")
+        addAnalysisArguments(analyze)
+        analyze.add_argument("--table", help = "save the analyzed tracks to this TrackTable file (.npz)")
+        analyze.set_defaults(run = runAnalyze)
+
+        playlist = commands.add_parser("playlist", help = "order tracks into a playlist by key")
+        addAnalysisArguments(playlist)
+        playlist.add_argument("--table", help = "order the tracks of this TrackTable file instead of analyzing paths")
+        playlist.add_argument("--seed",     type = int, help = "seed of the playlist, for reproducible playlists")
+        playlist.add_argument("--optimize", type = float, default = 0, help = "seconds spent improving the playlist")
+        playlist.set_defaults(run = runPlaylist)
+
+        tune = commands.add_parser("tune", help = "search for the configuration identifying keys best")
+        tune.add_argument("directory", help = "folder of the training tracks")
+        tune.add_argument("--storage",    choices = ("mongo", "sqlite"), help = "storage backend of the tunings")
+        tune.add_argument("--location",   help = "connection string of the MongoDB cluster, or SQLite file")
+        tune.add_argument("--genre")
+        tune.add_argument("--iterations", type = int)
+        tune.add_argument("--strategy")
+        tune.add_argument("--seed",       type = int)
+        tune.add_argument("--target",     type = float)
+        tune.set_defaults(run = runTune)
+
+        warm = commands.add_parser("warm", help = "decode tracks into the decoded audio cache")
+        warm.add_argument("paths", nargs = "+", help = "audio files or folders of audio files")
+        warm.add_argument("--cache", help = "folder of the cache, by default App.pcmCacheDirectory or PcmCache")
+        warm.add_argument("--size",  type = float, help = "maximum size of the cache, in GiB")
+        warm.add_argument("--processes", type = int)
+        warm.set_defaults(run = runWarm)
+
+        arguments = parser.parse_args(argv)
+
+        if arguments.command == "analyze" and not arguments.paths:
+            analyze.error("the paths of the tracks to analyze are required")
+        if arguments.command == "playlist" and not arguments.paths and arguments.table is None:
+            playlist.error("the paths of the tracks to order, or a --table, are required")
+
+        arguments.run(arguments)
+
+
+def addAnalysisArguments(parser):
+    parser.add_argument("paths", nargs = "*", help = "audio files or folders of audio files")
+    parser.add_argument("--genre")
+    parser.add_argument("--processes",     type = int)
+    parser.add_argument("--feature-cache", help = "folder in which extracted features are kept between runs")
+    parser.add_argument("--pcm-cache",     help = "folder in which decoded audio is kept between runs")
+    parser.add_argument("--metrics",       help = "record metrics, writing them to this path with .json and .prom")
+
+
+def runAnalyze(arguments):
+    tracks = []
+    for track in analyzeTracks(arguments):
+        print(track.easyKey + " ~ " + track.name)
+        tracks.append(track)
+
+    if arguments.table is not None:
+        import TrackTable
+
+        TrackTable.TrackTable.fromTracks(tracks).save(arguments.table)
+
+    writeMetrics(arguments)
+
+
+def runPlaylist(arguments):
+    import Playlists
+    import random
+
+    if arguments.table is not None:
+        import TrackTable
+
+        tracks = TrackTable.TrackTable.load(arguments.table)
+    else:
+        tracks = list(analyzeTracks(arguments))
+
+    playlist = Playlists.buildPlaylist(tracks, random.Random(arguments.seed), arguments.optimize)
+
+    for track in playlist:
+        print(track.easyKey + " ~ " + track.name)
+
+    writeMetrics(arguments)
+
+
+def runTune(arguments):
+    import MachineLearner
+
+    MachineLearner.directory = arguments.directory
+
+    for name in ("genre", "iterations", "strategy", "seed", "target"):
+        if getattr(arguments, name) is not None:
+            setattr(MachineLearner, name, getattr(arguments, name))
+
+    if arguments.storage is not None:
+        MachineLearner.storage = arguments.storage
+    if arguments.location is not None:
+        MachineLearner.storageLocation = arguments.location
+
+    MachineLearner.main()
+
+
+def runWarm(arguments):
+    import App
+    import PcmCache
+
+    cache = PcmCache.PcmCache(arguments.cache or App.pcmCacheDirectory or "PcmCache", App.getAnalysisRate(),
+                              App.analysisDtype, int(arguments.size * (1 << 30)) if arguments.size else App.pcmCacheSize)
+
+    filePaths = [track.filePath for track in getTracks(arguments.paths)]
+
+    print("Decoded {0} of {1} tracks into {2}".format(cache.warm(filePaths, arguments.processes), len(filePaths),
+                                                      cache.directory))
+
+
+def analyzeTracks(arguments):
+
+    #   Yields the tracks at the given paths as they are analyzed, using the caches and metrics named by the arguments
+
+        import Analyzer
+        import App
+        import Executor
+        import FeatureCache
+        import Metrics
+
+        if arguments.genre is not None:
+            App.genre = arguments.genre
+        if arguments.pcm_cache is not None:
+            App.pcmCacheDirectory = arguments.pcm_cache
+
+        Metrics.enabled = arguments.metrics is not None
+        featureCache    = None
+
+        if arguments.feature_cache is not None:
+            featureCache = FeatureCache.FeatureCache(arguments.feature_cache, App.getAnalysisParameters())
+
+        tracks = getTracks(arguments.paths)
+        for track in tracks:
+            track.configuration = Analyzer.Configuration("Orchestral")
+            track.genre         = App.genre
+
+        with Executor.AnalysisExecutor(arguments.processes, featureCache) as executor:
+            yield from executor.analyze(tracks)
+
+
+def getTracks(paths):
+
+    #   Returns a Track for every supported audio file among the given paths, searching folders recursively
+
+        import Scanner
+        from pathlib import Path
+
+        tracks = []
+        scan   = Scanner.ScanResult()
+
+        for path in paths:
+            if Path(path).is_dir():
+                tracks.extend(Scanner.getTrack(filePath) for filePath, _ in Scanner.findFiles(path, scan))
+            else:
+                tracks.append(Scanner.getTrack(path))
+
+        if scan.unsupported:
+            print(str(scan.unsupported) + " unsupported files were ignored")
+
+        return tracks
+
+
+def writeMetrics(arguments):
+    if arguments.metrics is not None:
+        import Metrics
+        from pathlib import Path
+
+        Path(arguments.metrics + ".json").write_text(Metrics.toJson())
+        Path(arguments.metrics + ".prom").write_text(Metrics.toPrometheus())
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import App
+import Metrics
+import Spectrum
+import TrackTable
+import numpy as np
+import os
+import queue
+from collections import deque
+from math import ceil
+from multiprocessing import Pool
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+hybridScheduling = True  # Split tracks much longer than the rest of the library across threads, see getThreadCounts
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class AnalysisExecutor:
+
+    #   The AnalysisExecutor keeps a pool of worker processes alive across analyses. Tracks are scheduled one at a time,
+    #   largest file first, so that idle workers keep taking tracks while a long one is still being analyzed. Workers
+    #   send back compact feature arrays rather than Track objects, and finished tracks are yielded as they arrive.
+    #   While Metrics are enabled, workers also send back what they recorded, aggregated by worker. With hybrid
+    #   scheduling, a track long enough to hold back the whole analysis is also split across threads of its worker.
+    #   Tracks are only handed to the pool while threads of the running ones leave a core idle, and a track never gets
+    #   more threads than there are idle cores, so that the threads of all workers never outnumber the processes
+
+        def __init__(self, processes = None, featureCache = None):
+            self.featureCache = featureCache
+            self.processes    = processes or os.cpu_count()
+
+        #   The note tables are built before the workers start, so that forked workers inherit them
+            Spectrum.getNoteThresholds(App.fundamentalNotes)
+
+            self.pool = Pool(processes = self.processes)
+
+
+        def __enter__(self):
+            return self
+
+
+        def __exit__(self, *exception):
+            self.close()
+
+
+        def close(self):
+            self.pool.close()
+            self.pool.join()
+
+
+        def extract(self, tracks):
+
+        #   Extracts the features of the given tracks, yielding each track as soon as its features are available
+            for i, features in self.receiveFeatures(tracks):
+                yield setFeatures(tracks[i], features)
+
+
+        def extractTable(self, tracks):
+
+        #   Extracts the features of the given tracks into a TrackTable, one row per track in the order of the tracks,
+        #   without unpacking the features onto the tracks
+            table = TrackTable.TrackTable(len(tracks))
+
+            for i, (_, duration, halfwaySample, presences) in self.receiveFeatures(tracks):
+                table.presences[i]      = presences
+                table.durations[i]      = duration
+                table.halfwaySamples[i] = halfwaySample
+                table.names[i]          = tracks[i].name
+                table.filePaths[i]      = tracks[i].filePath
+
+            return table
+
+
+        def receiveFeatures(self, tracks):
+
+        #   Yields the index and features of each of the given tracks as they arrive
+            sizes    = [getFileSize(track.filePath) for track in tracks]
+            order    = deque(sorted(range(len(tracks)), key=lambda i: sizes[i], reverse=True))
+            threads  = getThreadCounts(sizes, self.processes) if hybridScheduling else [1] * len(tracks)
+            settings = App.getAnalysisSettings()
+            results  = queue.Queue()
+            running  = {}  # Threads of the tracks being analyzed, by index
+            idle     = self.processes
+
+            while order or running:
+                while order and idle > 0:
+                    i          = order.popleft()
+                    running[i] = min(threads[i], idle)
+                    idle      -= running[i]
+                    task       = (i, tracks[i].filePath, tracks[i].extension, tracks[i].name, tracks[i].genre,
+                                  tracks[i].contentHash, self.featureCache, settings, running[i], Metrics.enabled)
+
+                    self.pool.apply_async(extractTrackFeatures, (task,), callback = results.put,
+                                          error_callback = results.put)
+
+                result = results.get()
+                if isinstance(result, BaseException):
+                    raise result
+
+                i, features, processId, metrics = result
+                idle += running.pop(i)
+
+                if metrics is not None:
+                    Metrics.addWorkerSnapshot(processId, metrics)
+
+                yield i, features
+
+
+        def analyze(self, tracks):
+
+        #   Extracts the features of the given tracks and identifies their keys, yielding each track once analyzed
+            for track in self.extract(tracks):
+                App.assignTrackKeys(track)
+
+                yield track
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def extractTrackFeatures(task):
+
+    #   Runs in a worker process, extracting the features of one track and returning them with the track's index, the
+    #   worker's process id, and the metrics recorded for the track if they are enabled
+
+        i, filePath, extension, name, genre, contentHash, featureCache, settings, threads, metricsEnabled = task
+
+    #   The pool outlives any one analysis, and workers started by spawn or forkserver don't inherit the settings of
+    #   this process, so each task sets the analysis settings, the track's threads and whether metrics are recorded
+        App.setAnalysisSettings(settings)
+        App.analysisThreads = threads
+        Metrics.enabled     = metricsEnabled
+
+        track             = App.Track(filePath, extension, name)
+        track.genre       = genre
+        track.contentHash = contentHash
+
+        Metrics.reset()
+        App.extractFeatures(track, featureCache)
+
+        return i, getFeatures(track), os.getpid(), Metrics.getSnapshot() if Metrics.enabled else None
+
+
+def getThreadCounts(sizes, processes):
+
+    #   Returns the threads to analyze each track with, given their file sizes as a measure of their length. Once
+    #   the tracks are spread across the processes, the analysis can't end before the longest track is done, so a track
+    #   longer than an even share of the library's length gets one thread per share it spans, up to one per process.
+    #   A library of similar tracks thus keeps one thread per track, and one dominated by a few long works splits them.
+    #   These are upper bounds, which receiveFeatures lowers to the cores left idle when a track is handed to the pool
+
+        share = sum(sizes) / processes
+
+        if share == 0:
+            return [1] * len(sizes)
+
+        return [min(processes, max(1, ceil(size / share))) for size in sizes]
+
+
+def getFeatures(track):
+
+    #   Packs the features of a track into its length, duration, halfway sample, and a (3 x 12) array of its presences
+
+        presences = np.array([[getattr(track, presenceName)[note] for note in App.chromaticScale]
+                              for presenceName in TrackTable.presenceNames], dtype=np.float64)
+
+        return track.length, track.duration, track.halfwaySample, presences
+
+
+def setFeatures(track, features):
+
+    #   Unpacks features produced by getFeatures onto a track
+
+        track.length, track.duration, track.halfwaySample, presences = features
+
+        for presenceName, presence in zip(TrackTable.presenceNames, presences.tolist()):
+            setattr(track, presenceName, dict(zip(App.chromaticScale, presence)))
+
+        return track
+
+
+def getFileSize(filePath):
+    try:
+        return os.path.getsize(filePath)
+    except OSError:
+        return 0
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+hashBlockSize  = 1 << 20  # Bytes read at a time when hashing a file
+featureVersion = 2        # Increase whenever the way features are extracted changes
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class FeatureCache:
+
+    #   The FeatureCache stores the audio features of tracks (their note presences, length, duration and halfway
+    #   sample) on disk, keyed by the hash of the audio file's contents. Entries are also keyed by the analysis
+    #   parameters they were extracted with, so changing a parameter such as the FFT size invalidates every entry
+
+        def __init__(self, directory, parameters):
+            self.directory   = Path(directory)
+            self.fingerprint = hashlib.blake2b(json.dumps(dict(parameters, featureVersion = featureVersion),
+                                                          sort_keys = True).encode(), digest_size = 8).hexdigest()
+
+            self.directory.mkdir(parents = True, exist_ok = True)
+
+
+        def getPath(self, contentHash):
+            return self.directory / (contentHash + "-" + self.fingerprint + ".json")
+
+
+        def load(self, track, contentHash = None):
+
+        #   Fills in the features of a track from the cache, returning whether they were found
+            path = self.getPath(contentHash or hashFile(track.filePath))
+
+            try:
+                with open(path) as file:
+                    features = json.load(file)
+            except (OSError, ValueError):
+                return False
+
+            track.length        = features["length"]
+            track.duration      = features["duration"]
+            track.halfwaySample = features["halfwaySample"]
+            track.presence      = features["presence"]
+            track.startPresence = features["startPresence"]
+            track.endPresence   = features["endPresence"]
+
+            return True
+
+
+        def save(self, track, contentHash = None):
+
+        #   Writes the features of an analyzed track to the cache. The file is written under a temporary name and
+        #   renamed, so that concurrent workers never read a partially written entry
+            path = self.getPath(contentHash or hashFile(track.filePath))
+
+            features = {"length"        : track.length,
+                        "duration"      : track.duration,
+                        "halfwaySample" : track.halfwaySample,
+                        "presence"      : {note: float(power) for note, power in track.presence.items()},
+                        "startPresence" : {note: float(power) for note, power in track.startPresence.items()},
+                        "endPresence"   : {note: float(power) for note, power in track.endPresence.items()}}
+
+            temporaryPath = path.with_name(path.name + "." + str(os.getpid()) + ".tmp")
+            with open(temporaryPath, "w") as file:
+                json.dump(features, file)
+
+            os.replace(temporaryPath, path)
+
+
+        def prune(self):
+
+        #   Deletes the entries extracted with analysis parameters other than the current ones
+            for path in self.directory.glob("*.json"):
+                if not path.stem.endswith("-" + self.fingerprint):
+                    path.unlink()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def hashFile(filePath):
+
+    #   Returns a hash of the contents of a file
+
+        digest = hashlib.blake2b(digest_size = 16)
+
+        with open(filePath, "rb") as file:
+            for block in iter(lambda: file.read(hashBlockSize), b""):
+                digest.update(block)
+
+        return digest.hexdigest()
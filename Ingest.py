@@ -0,0 +1,216 @@
+import Metrics
+import numpy as np
+from math import ceil, gcd
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+blockSize = 65536  # Frames decoded at a time when streaming a file
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class StreamReader:
+
+    #   The StreamReader decodes an audio file block by block, converting it to mono (and optionally to another sample
+    #   rate) as it goes. It can be sliced like the mono array of the whole track, but only keeps the samples from the
+    #   start of the latest requested region onwards, so requesting regions in increasing order keeps its memory use
+    #   flat regardless of the track length. Requesting a region before the kept samples, or after a gap, seeks within
+    #   the file
+
+        def __init__(self, filePath, analysisRate = None, dtype = np.float64):
+            import soundfile as sf
+
+            self.file       = sf.SoundFile(filePath)
+            self.dtype      = np.dtype(dtype)
+            self.resampler  = None
+            self.sampleRate = self.file.samplerate
+            self.frames     = self.file.frames
+
+            if analysisRate is not None and analysisRate != self.file.samplerate:
+                self.resampler  = Resampler(self.file.samplerate, analysisRate, self.dtype)
+                self.sampleRate = analysisRate
+                self.frames     = self.resampler.getLength(self.file.frames)
+
+            self.data     = np.empty(0, dtype=self.dtype)
+            self.start    = 0      # Sample at which the kept data starts
+            self.finished = False  # Whether the resampler was given the end of the file
+
+
+        def __enter__(self):
+            return self
+
+
+        def __exit__(self, *exception):
+            self.close()
+
+
+        def __len__(self):
+            return self.frames
+
+
+        def __getitem__(self, region):
+            start, stop, _ = region.indices(self.frames)
+            end = self.start + len(self.data)
+
+            if start < self.start or start > end:
+                self.seek(start)
+                end = self.start
+
+            if end < stop:
+                blocks = [self.data]
+                while end < stop:
+                    block = self.readBlock()
+                    if block is None:
+                        break
+
+                    blocks.append(block)
+                    end += len(block)
+
+                self.data = np.concatenate(blocks)
+
+            self.data  = self.data[start - self.start:]
+            self.start = start
+
+            return self.data[:max(0, stop - start)]
+
+
+        def seek(self, start):
+
+        #   Restarts decoding at a sample, or at the start of its resampling chunk when resampling
+            if self.resampler is None:
+                self.file.seek(start)
+                self.start = start
+            else:
+                self.start, fileStart = self.resampler.reset(start)
+                self.file.seek(fileStart)
+                self.finished = False
+
+            self.data = np.empty(0, dtype=self.dtype)
+
+
+        def readBlock(self):
+
+        #   Returns the next decoded mono block, or None at the end of the file
+            while True:
+                with Metrics.stage("decode"):
+                    block = self.file.read(blockSize, dtype=self.dtype.name, always_2d=True)
+
+                if self.resampler is None:
+                    return downmix(block) if len(block) else None
+
+                if len(block):
+                    block = self.resampler.feed(downmix(block))
+                elif not self.finished:
+                    block = self.resampler.feed(np.empty(0, dtype=self.dtype), final = True)
+                    self.finished = True
+                else:
+                    return None
+
+                if len(block):
+                    return block
+
+
+        def close(self):
+            self.file.close()
+
+
+class Resampler:
+
+    #   Anti-aliased polyphase resampling of a stream of blocks. The stream is resampled in chunks aligned to the
+    #   resampling ratio, each with enough input on either side to cover the filter, so the result matches resampling
+    #   the whole signal with scipy.signal.resample_poly
+
+        def __init__(self, sourceRate, targetRate, dtype = np.float64):
+            divisor     = gcd(int(sourceRate), int(targetRate))
+            self.dtype  = dtype
+            self.up     = int(targetRate) // divisor
+            self.down   = int(sourceRate) // divisor
+            self.chunk  = max(1, blockSize // self.down)  # Chunk length, in multiples of the down factor
+
+        #   resample_poly's filter reaches 10 * max(up, down) upsampled samples to either side of each output sample
+            self.padding = self.down * int(ceil((10 * max(self.up, self.down) / self.up + 1) / self.down))
+
+            self.reset(0)
+
+
+        def getLength(self, frames):
+            return int(ceil(frames * self.up / self.down))
+
+
+        def reset(self, position):
+
+        #   Restarts resampling at the chunk containing an output sample. Returns the output sample the next chunk
+        #   starts at, and the input sample the stream must be fed from
+            chunkLength = self.chunk * self.up
+            outputStart = position // chunkLength * chunkLength
+            inputStart  = outputStart // self.up * self.down - self.padding
+
+        #   The signal is zero before its first sample
+            self.pending = np.zeros(max(0, -inputStart), dtype=self.dtype)
+
+            return outputStart, max(0, inputStart)
+
+
+        def feed(self, samples, final = False):
+
+        #   Takes the next input samples, returning every output sample whose chunk is complete. The last call must
+        #   be final, padding the end of the signal with zeros so that its last chunk completes
+            from scipy.signal import resample_poly
+
+            chunkInput    = self.chunk * self.down
+            trim          = self.padding * self.up // self.down
+            self.pending  = np.concatenate((self.pending, samples))
+
+            if final:
+                self.pending = np.concatenate((self.pending, np.zeros(chunkInput + 2 * self.padding, dtype=self.dtype)))
+
+            outputs = [np.empty(0, dtype=self.dtype)]
+            with Metrics.stage("resample"):
+                while len(self.pending) >= chunkInput + 2 * self.padding:
+                    segment = self.pending[:chunkInput + 2 * self.padding]
+                    outputs.append(resample_poly(segment, self.up, self.down)[trim : trim + self.chunk * self.up])
+
+                    self.pending = self.pending[chunkInput:]
+
+            return np.concatenate(outputs)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def read(filePath, analysisRate = None, dtype = np.float64):
+
+    #   Decodes a whole track, returning its mono audio data (resampled to the analysis rate if one is given) and
+    #   its sample rate
+
+        import soundfile as sf
+
+        with Metrics.stage("decode"):
+            data, sampleRate = sf.read(filePath, dtype=np.dtype(dtype).name, always_2d=True)
+
+        data = downmix(data)
+
+        if analysisRate is not None and analysisRate != sampleRate:
+            data, sampleRate = resample(data, sampleRate, analysisRate), analysisRate
+
+        return data, sampleRate
+
+
+def downmix(block):
+
+    #   Converts a (frames x channels) block to mono by summing all of its channels
+
+        with Metrics.stage("downmix"):
+            if block.shape[1] == 1:
+                return block[:, 0].copy()
+
+            return block.sum(axis=1)
+
+
+def resample(data, sourceRate, targetRate):
+
+    #   Resamples a whole mono signal with an anti-aliasing polyphase filter. Requires scipy
+
+        from scipy.signal import resample_poly
+
+        divisor = gcd(int(sourceRate), int(targetRate))
+
+        with Metrics.stage("resample"):
+            return resample_poly(data, int(targetRate) // divisor, int(sourceRate) // divisor)
@@ -1,71 +1,106 @@
 import App
 import Analyzer
-import pymongo
-from pymongo import MongoClient
+import FeatureCache
+import Tuning
+import Executor
+import Storage
+import numpy as np
 import multiprocessing
-from multiprocessing import Pool
-from math import ceil
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-# Insert your MongoDB credential here
-mongo = MongoClient("mongodb+srv://{credential}.mongodb.net/")
+storage         = "mongo"                                    # Storage backend, one of Storage.backends
+storageLocation = "mongodb+srv://{credential}.mongodb.net/"  # Insert your MongoDB credential here, or an SQLite file
 
 cores      = multiprocessing.cpu_count()     # Number of cores to be used in multiprocessing
 directory  = "Insert training data folder here"
+featureCacheDirectory = "FeatureCache"       # Folder in which extracted track features are kept between runs
 genre      = "Orchestral"                    # Genre attributed to the Configuration
-iterations = 1000
+iterations = 1000                            # Budget of configurations scored against the full library
+strategy   = "cmaes"                         # Search strategy, one of Tuning.optimizers
+seed       = None                            # Seed of the search, for reproducible runs
+target     = None                            # Score at which the search stops early
 
 def main():
 
-    database = mongo.MusicalPlaylists
-    tunings  = database.Tunings
-    cursor   = database.Tracks.find()
+    with Storage.backends[storage](storageLocation) as database:
+        tune(database)
+
+
+def tune(database):
 
 #   Get all tracks from database to serve as a key for the machine learner
     trackDocuments = {}
-    for track in cursor:
+    for track in database.getTrackDocuments():
         trackDocuments[track["track"]] = {  "startingKey"         : track["startingKey"],
                                             "closingKey"          : track["closingKey"],
                                             "startingRelativeKey" : track.get("startingRelativeKey", None),
                                             "closingRelativeKey"  : track.get("closingRelativeKey",  None)  }
 
-#   Generate a random configuration to analyze tracks and upload results to database
-    for x in range(iterations):
-
-        tracks = App.getPlaylist(directory)
-        configuration = Analyzer.Configuration()
+#   Extract the features of every track once. Features only depend on the audio, so they are cached on disk and
+#   reused by every iteration, as well as by later runs with the same analysis parameters
+    featureCache = FeatureCache.FeatureCache(featureCacheDirectory, App.getAnalysisParameters())
+    tracks       = App.getPlaylist(directory)
 
-    #   Add configuration and genre to each track so they can be accessed by App.py
-        for track in tracks:
-            track.configuration = configuration
-            track.genre         = genre
+    for track in tracks:
+        track.genre = genre
 
-    #   Determine how many tracks should be processed by each core
-        chunkSize = int(ceil(len(tracks) / cores))
+#   Extract features using multiprocessing, into a table whose presences are scored without unpacking them
+    with Executor.AnalysisExecutor(cores, featureCache) as executor:
+        analyzedTracks = executor.extractTable(tracks)
 
-    #   Analyse tracks using multiprocessing
-        pool = Pool(processes = cores)
-        analyzedTracks = pool.map(App.analyzeTrack, tracks, chunkSize)
-        pool.close()
+#   Search for the best configuration, identifying the keys of every track with all configurations of a batch at once.
+#   The search resumes from the configurations previously uploaded for this genre
+    targetTonics = getTargetTonics(analyzedTracks, trackDocuments)
+    optimizer    = Tuning.optimizers[strategy](seed)
 
-    #   Check each track analysis against our key to determine score of configuration
-        score = 0
-        for track in analyzedTracks:
-            trackDocument = trackDocuments[track.name]
+    optimizer.resume(database.getTunings(genre))
 
-            if ((track.startKey.tonic == trackDocument["startingKey"] or track.startKey.tonic == trackDocument["startingRelativeKey"])
-            and (track.endKey.tonic   == trackDocument["closingKey"]  or track.endKey.tonic   == trackDocument["closingRelativeKey"])):
-                score += 1
+    def evaluate(configurations, trackIndices):
+        if trackIndices is None:
+            return scoreConfigurations(configurations, analyzedTracks, targetTonics)
 
-        score = round(score / len(tracks), 4) * 100
+        return scoreConfigurations(configurations, analyzedTracks.take(trackIndices), targetTonics[:, trackIndices])
 
-    #   Upload configuration and score to our database
+#   Upload configurations and scores to our database. Uploads are buffered, and written together
+    def upload(configuration, score):
         tuningDocument = {"score"        : score,
                           "genre"        : genre,
                           "coefficients" : configuration.toDictionary()}
 
-        tunings.insert_one(tuningDocument)
+        database.addTuning(tuningDocument)
+
+    optimizer.optimize(evaluate, len(analyzedTracks), iterations, target, upload)
+
+
+def getTargetTonics(tracks, trackDocuments):
+
+#   Returns the indices of the starting, starting relative, closing and closing relative keys of each track of a
+#   TrackTable in our key as a (4 x tracks) array, with -1 where a track has no relative key, or a key not spelled as
+#   in App.chromaticScale, which no analysis matches
+
+    targetTonics = np.full((4, len(tracks)), -1)
+    tonicIndices = {tonic: i for i, tonic in enumerate(App.chromaticScale)}
+
+    for i in range(len(tracks)):
+        trackDocument = trackDocuments[tracks.names[i]]
+
+        for j, keyName in enumerate(("startingKey", "startingRelativeKey", "closingKey", "closingRelativeKey")):
+            targetTonics[j, i] = tonicIndices.get(trackDocument[keyName], -1)
+
+    return targetTonics
+
+
+def scoreConfigurations(configurations, tracks, targetTonics):
+
+#   Check each track analysis against our key to determine the score of every configuration
+
+    startTonics, endTonics = App.getTrackTonics(tracks, configurations, genre)
+
+    correct = (((startTonics == targetTonics[0]) | (startTonics == targetTonics[1]))
+             & ((endTonics   == targetTonics[2]) | (endTonics   == targetTonics[3])))
+
+    return [round(score / len(tracks), 4) * 100 for score in np.count_nonzero(correct, axis=1).tolist()]
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+enabled = False  # Whether stages and counters are recorded. When disabled, recording costs a flag check
+
+#   Stages of the analysis, each timed inclusively of the stages it contains
+stageNames   = ("extractFeatures", "decode", "downmix", "resample", "fft", "filterbank", "notePower", "tonic")
+counterNames = ("tracksAnalyzed", "cacheHits", "buffersAnalyzed", "buffersGated", "peaksFound", "overtoneTests",
+                "fundamentalsFound")
+
+prometheusPrefix = "playlists_"
+
+#   Totals recorded by this process: calls, wall seconds and CPU seconds by stage, and counters. A stage's CPU seconds
+#   are those of the thread that ran it, so that stages run by several analysis threads at once are not each charged
+#   the CPU time of the others. Threads started by a library within a stage, such as scipy's FFT workers, aren't counted
+stages   = {name: [0, 0.0, 0.0] for name in stageNames}
+counters = dict.fromkeys(counterNames, 0)
+workers  = {}  # Snapshots of the totals recorded by each worker process, by process id
+lock     = threading.Lock()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class Stage:
+
+    #   The Stage object times the code run inside it, adding its wall time and its thread's CPU time to the totals of
+    #   its stage
+
+        def __init__(self, name):
+            self.name = name
+
+
+        def __enter__(self):
+            self.wall = time.perf_counter()
+            self.cpu  = time.thread_time()
+
+            return self
+
+
+        def __exit__(self, *exception):
+            wall = time.perf_counter() - self.wall
+            cpu  = time.thread_time() - self.cpu
+
+            with lock:
+                totals     = stages[self.name]
+                totals[0] += 1
+                totals[1] += wall
+                totals[2] += cpu
+
+
+class DisabledStage:
+
+    #   Stand-in for Stage while recording is disabled, doing nothing
+
+        def __enter__(self):
+            return self
+
+
+        def __exit__(self, *exception):
+            pass
+
+
+disabledStage = DisabledStage()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def stage(name):
+
+    #   Returns a context timing a stage, e.g. with Metrics.stage("fft"): ...
+
+        return Stage(name) if enabled else disabledStage
+
+
+def count(name, amount = 1):
+    if enabled:
+        with lock:
+            counters[name] += amount
+
+
+def reset():
+    with lock:
+        for totals in stages.values():
+            totals[:] = [0, 0.0, 0.0]
+
+        for name in counters:
+            counters[name] = 0
+
+
+def getSnapshot():
+
+    #   Returns a copy of the totals recorded by this process
+
+        with lock:
+            return {"stages"   : {name: {"calls": calls, "wallSeconds": wall, "cpuSeconds": cpu}
+                                  for name, (calls, wall, cpu) in stages.items()},
+                    "counters" : dict(counters)}
+
+
+def addWorkerSnapshot(processId, snapshot):
+
+    #   Adds the totals recorded by a worker process (for instance, during one task) to that worker's aggregate
+
+        aggregate = workers.setdefault(processId, getEmptySnapshot())
+
+        with lock:
+            mergeSnapshot(aggregate, snapshot)
+
+
+def getReport():
+
+    #   Returns the totals of this process and of every worker, each by itself and all together
+
+        local           = getSnapshot()
+        total           = getEmptySnapshot()
+        workerSnapshots = {str(processId): snapshot for processId, snapshot in workers.items()}
+
+        for snapshot in [local] + list(workerSnapshots.values()):
+            mergeSnapshot(total, snapshot)
+
+        return {"total" : total, "workers" : dict(workerSnapshots, **{str(os.getpid()): local})}
+
+
+def toJson():
+    return json.dumps(getReport(), indent = 4)
+
+
+def toPrometheus():
+
+    #   Returns the totals of every process in the Prometheus text exposition format, labeled by stage and worker
+
+        report       = getReport()
+        lines        = []
+        stageMetrics = (("stage_calls_total",        "calls",       "Times a stage ran"),
+                        ("stage_wall_seconds_total", "wallSeconds", "Wall-clock time spent in a stage"),
+                        ("stage_cpu_seconds_total",  "cpuSeconds",  "CPU time of the thread running a stage"))
+
+        for metric, field, description in stageMetrics:
+            lines.append("# HELP " + prometheusPrefix + metric + " " + description)
+            lines.append("# TYPE " + prometheusPrefix + metric + " counter")
+
+            for worker, snapshot in report["workers"].items():
+                for name, totals in snapshot["stages"].items():
+                    lines.append('{0}{1}{{stage="{2}",worker="{3}"}} {4}'.format(prometheusPrefix, metric, name, worker,
+                                                                                 totals[field]))
+
+        for name in counterNames:
+            metric = prometheusPrefix + toSnakeCase(name) + "_total"
+
+            lines.append("# TYPE " + metric + " counter")
+            for worker, snapshot in report["workers"].items():
+                lines.append('{0}{{worker="{1}"}} {2}'.format(metric, worker, snapshot["counters"][name]))
+
+        return "\n".join(lines) + "\n"
+
+
+def getEmptySnapshot():
+    return {"stages"   : {name: {"calls": 0, "wallSeconds": 0.0, "cpuSeconds": 0.0} for name in stageNames},
+            "counters" : dict.fromkeys(counterNames, 0)}
+
+
+def mergeSnapshot(aggregate, snapshot):
+    for name, totals in snapshot["stages"].items():
+        for field, value in totals.items():
+            aggregate["stages"][name][field] += value
+
+    for name, value in snapshot["counters"].items():
+        aggregate["counters"][name] += value
+
+
+def toSnakeCase(name):
+    return "".join("_" + character.lower() if character.isupper() else character for character in name)
@@ -76,16 +76,29 @@ class Note:
 
 #   Returns the aggregate power level of all frequency bins belonging to a note in a buffer analysis
     def getPower(self, buffer):
+        lowerIndex, upperIndex = self.getBinRange(buffer.binSize)
+
+        return sum(buffer.analysis[lowerIndex : upperIndex])
+
+
+#   Returns the range of frequency bins belonging to the note for a given bin size, as slice indices
+    def getBinRange(self, binSize):
+        lowerThreshold, upperThreshold = self.getThresholds()
+
+    #   Reduce indices by 1 to compensate for removed DC offset and return result
+        lowerIndex = int(round((lowerThreshold - 1) / binSize, 0))
+        upperIndex = int(round((upperThreshold - 1) / binSize, 0))
+
+        return lowerIndex, upperIndex
+
+
+#   Returns the frequencies 50 cents below and above the note, in whole hertz inside that range
+    def getThresholds(self):
     #   Get neighbor notes
         noteBelow = self.getAdjacent(-1)
         noteAbove = self.getAdjacent( 1)
 
-    #   Determine the range of frequency bins applicable to this note by finding the frequencies 50 cents below and above
         lowerThreshold = int(math.ceil( self.frequency + (abs((self.frequency - noteBelow.frequency)) * -0.5)))
         upperThreshold = int(math.floor(self.frequency + (abs((self.frequency - noteAbove.frequency)) *  0.5)))
 
-    #   Reduce indices by 1 to compensate for removed DC offset and return result
-        lowerIndex = int(round((lowerThreshold - 1) / buffer.binSize, 0))
-        upperIndex = int(round((upperThreshold - 1) / buffer.binSize, 0))
-
-        return sum(buffer.analysis[lowerIndex : upperIndex])
\ No newline at end of file
+        return lowerThreshold, upperThreshold
\ No newline at end of file
@@ -0,0 +1,243 @@
+import FeatureCache
+import Ingest
+import hashlib
+import json
+import numpy as np
+import os
+from multiprocessing import Pool
+from pathlib import Path
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+pcmVersion  = 1         # Increase whenever the way decoded audio is produced changes
+maximumSize = 16 << 30  # Bytes of decoded audio kept before the least recently used entries are evicted
+
+workerCache = None      # The PcmCache warmed by a worker process of PcmCache.warm
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class PcmCache:
+
+    #   The PcmCache stores the decoded mono audio of tracks, at the analysis rate and precision, as .npy files keyed by
+    #   the hash of the audio file's contents. Only the ingest parameters are part of the key, so changing the FFT size
+    #   or the overlap keeps every entry. Entries are opened as read-only memory maps, which worker processes share
+    #   through the page cache without copying them. Reading an entry marks it as used, and once the entries exceed
+    #   the maximum size, the least recently used ones are deleted
+    #
+    #   With an analysis rate, an entry's path is known from its hash. Without one, entries are also keyed by their
+    #   native sample rate, so the directory is listed once per process into an index of the entries by hash. The size
+    #   of the entries is also counted once, then kept up to date as entries are saved, so that neither lookups nor
+    #   saves list the whole directory. As each process only counts its own saves, the cache can exceed its maximum
+    #   size by what other processes saved since, until one of them evicts, which counts every entry again
+
+        def __init__(self, directory, analysisRate = None, dtype = np.float64, maximumSize = maximumSize):
+            self.directory    = Path(directory)
+            self.analysisRate = analysisRate
+            self.dtype        = np.dtype(dtype)
+            self.maximumSize  = maximumSize
+            self.fingerprint  = hashlib.blake2b(json.dumps({"analysisRate" : analysisRate,
+                                                            "dtype"        : self.dtype.name,
+                                                            "pcmVersion"   : pcmVersion}, sort_keys = True).encode(),
+                                                digest_size = 8).hexdigest()
+            self.entries      = None  # Paths of the entries of these parameters by hash, without an analysis rate
+            self.size         = None  # Bytes of every entry in the directory, as last counted plus those saved since
+
+            self.directory.mkdir(parents = True, exist_ok = True)
+
+
+        def __getstate__(self):
+
+        #   The index and size are counted again by each process rather than copied to it
+            return dict(self.__dict__, entries = None, size = None)
+
+
+        def getPath(self, contentHash, sampleRate):
+            return self.directory / (contentHash + "-" + self.fingerprint + "-" + str(sampleRate) + ".npy")
+
+
+        def getEntries(self):
+            if self.entries is None:
+                self.entries = {}
+                for path in self.directory.glob("*-" + self.fingerprint + "-*.npy"):
+                    self.entries[path.name.split("-", 1)[0]] = path
+
+            return self.entries
+
+
+        def read(self, filePath, contentHash = None, streaming = False):
+
+        #   Returns the mono audio data of a track and its sample rate, decoding and storing it if it isn't cached.
+        #   When streaming, the track is decoded and written to its entry block by block, and the entry is returned
+        #   mapped, so that the whole track is never held in memory
+            contentHash = contentHash or FeatureCache.hashFile(filePath)
+            cached      = self.load(contentHash)
+
+            if cached is not None:
+                return cached
+
+            if streaming:
+                return self.saveStream(contentHash, filePath)
+
+            data, sampleRate = Ingest.read(filePath, self.analysisRate, self.dtype)
+            self.save(contentHash, data, sampleRate)
+
+            return data, sampleRate
+
+
+        def load(self, contentHash):
+
+        #   Returns the memory mapped audio data and sample rate of an entry, or None if it isn't cached
+            if self.analysisRate is not None:
+                path = self.getPath(contentHash, self.analysisRate)
+            else:
+                path = self.getEntries().get(contentHash)
+
+            if path is None:
+                return None
+
+            try:
+                data = np.load(path, mmap_mode = "r")
+                os.utime(path)
+            except (OSError, ValueError):
+                return None
+
+            return data, int(path.stem.rsplit("-", 1)[1])
+
+
+        def save(self, contentHash, data, sampleRate):
+
+        #   Writes an entry under a temporary name and renames it, so that concurrent workers never map a partially
+        #   written entry, then evicts entries until the cache fits its maximum size
+            path          = self.getPath(contentHash, sampleRate)
+            temporaryPath = self.getTemporaryPath(path)
+
+            with open(temporaryPath, "wb") as file:
+                np.save(file, np.asarray(data, dtype=self.dtype))
+
+            self.addEntry(contentHash, temporaryPath, path)
+            self.addSize(path)
+
+
+        def saveStream(self, contentHash, filePath):
+
+        #   Decodes a track block by block into a new entry, returning the entry mapped and its sample rate
+            with Ingest.StreamReader(filePath, self.analysisRate, self.dtype) as source:
+                path          = self.getPath(contentHash, source.sampleRate)
+                temporaryPath = self.getTemporaryPath(path)
+
+                try:
+                    entry = np.lib.format.open_memmap(temporaryPath, mode = "w+", dtype = self.dtype,
+                                                      shape = (len(source),))
+
+                    for start in range(0, len(source), Ingest.blockSize):
+                        entry[start : start + Ingest.blockSize] = source[start : start + Ingest.blockSize]
+
+                    entry.flush()
+                    del entry
+                except BaseException:
+                    temporaryPath.unlink(missing_ok = True)
+                    raise
+
+        #   The entry is mapped before it counts towards the size, so that evicting it can't take it from the caller
+            self.addEntry(contentHash, temporaryPath, path)
+            data = np.load(path, mmap_mode = "r")
+            self.addSize(path)
+
+            return data, source.sampleRate
+
+
+        def getTemporaryPath(self, path):
+            return path.with_name(path.name + "." + str(os.getpid()) + ".tmp")
+
+
+        def addEntry(self, contentHash, temporaryPath, path):
+
+        #   Renames a written entry into place and adds it to the index
+            os.replace(temporaryPath, path)
+
+            if self.entries is not None:
+                self.entries[contentHash] = path
+
+
+        def addSize(self, path):
+
+        #   Adds a saved entry to the size, and evicts entries if they no longer fit the maximum size
+            if self.size is None:
+                self.evict()
+            else:
+                self.size += path.stat().st_size
+                if self.size > self.maximumSize:
+                    self.evict()
+
+
+        def evict(self):
+
+        #   Counts every entry, of any ingest parameters, and deletes the least recently used ones until the rest fit
+        #   the maximum size
+            entries = []
+            for path in self.directory.glob("*.npy"):
+                try:
+                    status = path.stat()
+                except OSError:
+                    continue
+
+                entries.append((status.st_mtime_ns, status.st_size, path))
+
+            self.size = sum(entry[1] for entry in entries)
+
+            for _, entrySize, path in sorted(entries):
+                if self.size <= self.maximumSize:
+                    break
+
+            #   An entry that is still mapped can't be deleted on Windows, and is kept
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+
+                self.size  -= entrySize
+                contentHash = path.name.split("-", 1)[0]
+
+                if self.entries is not None and self.entries.get(contentHash) == path:
+                    del self.entries[contentHash]
+
+
+        def warm(self, filePaths, processes = None):
+
+        #   Decodes and stores every given track that isn't cached yet, using a pool of worker processes, each
+        #   streaming its tracks into their entries. Returns the number of tracks that were decoded
+            with Pool(processes = processes, initializer = setWorkerCache, initargs = (self,)) as pool:
+                return sum(pool.imap_unordered(warmTrack, filePaths, chunksize = 1))
+
+
+        def warmTrack(self, filePath):
+
+        #   Returns whether a track had to be decoded
+            try:
+                contentHash = FeatureCache.hashFile(filePath)
+
+                if self.load(contentHash) is not None:
+                    return False
+
+                self.saveStream(contentHash, filePath)
+            except (OSError, RuntimeError) as error:
+                print("Could not decode " + str(filePath) + ": " + str(error))
+                return False
+
+            return True
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def setWorkerCache(cache):
+    global workerCache
+
+    workerCache = cache
+
+
+def warmTrack(filePath):
+
+    #   Runs in a worker process of PcmCache.warm, which is given the cache once rather than with every track
+
+        return workerCache.warmTrack(filePath)
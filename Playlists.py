@@ -1,8 +1,17 @@
+from __future__ import annotations
 from Note import Note
-from App import Track
-from App import Key
 import random
 import collections
+import itertools
+import time
+import numpy as np
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from typing import TYPE_CHECKING
+
+#   App imports this module, so its Track is only imported for annotations
+if TYPE_CHECKING:
+    from App import Track
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -16,32 +25,160 @@ neighborCoefficient   = 2
 historicalCoefficient = 1
 randomCoefficient     = 2
 
+optimizationSeconds   = 0    # Wall-clock budget of the local search improving each greedy playlist, 0 to disable
+optimizationBatch     = 256  # Swaps tried between checks of the optimization deadline
+
+#   Score contributions of each key, by the row of the previous key (2 * tonic index, plus 1 if minor), built once
+#   from the coefficients above. Entries accumulate in the same order the scoring once added them to a dictionary
+modes         = ["major", "minor"]
+harmonicTable = np.zeros((len(keys) * 2, len(keys)))
+diatonicTable = np.zeros((len(keys) * 2, len(keys)))
+neighborTable = np.zeros((len(keys), len(keys)), dtype=bool)
+
+for row in range(len(keys) * 2):
+    tonic = row // 2
+    scale = minorScale if modes[row % 2] == "minor" else majorScale
+
+    harmonicTable[row, tonic] += 1
+    for i in range(1, 6):
+        harmonicTable[row, (tonic + i * 7) % 12] += round(1 / i, 2) * harmonicCoefficient
+        harmonicTable[row, (tonic - i * 7) % 12] += round(1 / i, 2) * harmonicCoefficient
+
+    for i in scale:
+        diatonicTable[row, (tonic + i) % 12] += 1 * diatonicCoefficient
+
+#   Keys within a second of each other (2 halfsteps)
+for i in range(len(keys)):
+    for j in range(len(keys)):
+        neighborTable[i, j] = abs(i - j) <= 2 or abs(i - j) >= len(keys) - 2
+
+keyIndices = {key: i for i, key in enumerate(keys)}
+
+sharedLibrary   = None  # The library batch playlists are built from, set in each worker of buildPlaylists
+sharedPositions = None  # The position of each track of the shared library, by track id
+sharedIndex     = None  # A TrackIndex of the shared library, which each playlist built from it takes a view of
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-def buildPlaylist(tracks: list[Track]):
+def buildPlaylist(tracks: list[Track], rng = random, seconds = None):
+
+    #   Constructs a playlist using harmonic and musical convention, then spends the given number of seconds (by default
+    #   optimizationSeconds) improving its transitions with optimizePlaylist
+
+        playlist = list(generatePlaylist(tracks, rng = rng))
+        seconds  = optimizationSeconds if seconds is None else seconds
+
+        if seconds > 0:
+            playlist = optimizePlaylist(playlist, seconds, rng)
+
+        return playlist
+
+
+def buildPlaylists(library: list[Track], requests, processes = None, useThreads = False):
+
+    #   Builds a playlist from the same library for each PlaylistRequest, across a pool of worker processes (or
+    #   threads). Each request draws from its own seeded random stream, so the playlists only depend on the library and
+    #   the requests, never on how they were scheduled. Workers share the library read-only and send back the
+    #   positions of the tracks in it rather than the tracks themselves
+
+        poolType = ThreadPool if useThreads else Pool
+
+        if processes == 1:
+            setSharedLibrary(library)
+            results = [buildRequestedPlaylist(request) for request in requests]
+        else:
+            with poolType(processes, initializer = setSharedLibrary, initargs = (library,)) as pool:
+                results = pool.map(buildRequestedPlaylist, requests, chunksize = max(1, len(requests) // 64))
+
+        return [[library[i] for i in positions] for positions in results]
+
+
+def optimizePlaylist(playlist: list[Track], seconds, rng = random):
+
+    #   Anytime improvement of a playlist, usually the greedy one from buildPlaylist. Swaps random pairs of tracks and
+    #   keeps the swaps that raise the total transition score, until the wall-clock budget is spent. Returns a new
+    #   playlist, which scores at least as high as the given one
+
+        optimizer = PlaylistOptimizer(playlist)
+        deadline  = time.perf_counter() + seconds
+
+        if len(playlist) > 1:
+            while time.perf_counter() < deadline:
+                for i in range(optimizationBatch):
+                    optimizer.trySwap(rng.randrange(len(playlist)), rng.randrange(len(playlist)))
+
+        return optimizer.getPlaylist()
+
+
+def scorePlaylist(playlist: list[Track]):
+
+    #   Returns the total transition score of a playlist, as scored by optimizePlaylist
+
+        return PlaylistOptimizer(playlist).getScore()
+
+
+def generatePlaylist(tracks: list[Track], cooldown = None, rng = random, startingTonic = None, startingMode = None,
+                     trackIndex = None):
+
+    #   Yields the tracks of a playlist one at a time, using harmonic and musical convention. The tracks are never
+    #   modified, but indexing them files a reference to each in a TrackIndex, which takes time and memory linear in the
+    #   size of the library, so the starting track is yielded before the remaining tracks are indexed. Without a
+    #   cooldown, every track is played once. With one, a played track becomes available again after that many more
+    #   tracks have played, and the playlist never ends. Random choices are drawn from rng, a random.Random or the
+    #   random module itself. A starting tonic (and mode) can be requested, in which case the library is indexed first
+    #   to find a track in it, falling back to any track when the library has none. A TrackIndex of the tracks can be
+    #   given to save indexing them, and is consumed by the playlist
+
+        librarySize   = len(tracks)
+        keylist       = collections.deque(maxlen = 3)  # Neighbor scoring only looks at the last 3 keys
+        keyBuffer     = collections.deque(maxlen = getHistoryLength(librarySize))
+        coolingTracks = collections.deque()            # Played tracks, with the step at which they return
+
+        if not librarySize:
+            return
+
+        if startingTonic is None:
+            startingTrack = tracks[rng.randrange(librarySize)]
+
+            yield startingTrack
 
-    #   Constructs a playlist using harmonic and musical convention
+            trackIndex = TrackIndex(tracks, rng) if trackIndex is None else trackIndex
+            trackIndex.remove(startingTrack)
 
-        playlist      = []
-        keylist       = []
-        playlistSize  = len(tracks)
-        keyBuffer     = collections.deque(maxlen = playlistSize // 5 if playlistSize < 50 else 10)
-        startingTrack = tracks[random.randint(0, len(tracks) - 1)]
+        else:
+            trackIndex = TrackIndex(tracks, rng) if trackIndex is None else trackIndex
+
+            if trackIndex.count(startingTonic, startingMode):
+                startingTrack = trackIndex.pop(startingTonic, startingMode)
+            else:
+                startingTrack = trackIndex.popRandom()
+
+            yield startingTrack
 
-        playlist .append(startingTrack)
-        tracks   .remove(startingTrack)
         keylist  .append(startingTrack.startKey)
         keyBuffer.append(startingTrack.startKey)
         if startingTrack.startKey.tonic != startingTrack.endKey.tonic:
             keylist  .append(startingTrack.endKey)
             keyBuffer.append(startingTrack.endKey)
 
-        for i in range(1, playlistSize):
+        previousTrack = startingTrack
+        step          = 1
+
+        while True:
+
+        #   Return tracks whose cooldown has passed, or the longest cooled track if nothing else remains
+            if cooldown is not None:
+                coolingTracks.append((step + cooldown, previousTrack))
+
+                while coolingTracks and (coolingTracks[0][0] <= step or not len(trackIndex)):
+                    trackIndex.add(coolingTracks.popleft()[1])
 
-            previousTrack = playlist[i - 1]
-            previousKey   = previousTrack.endKey
+            if not len(trackIndex):
+                return
 
-            keyScores = dict.fromkeys(keys, 0.0)
+            previousKey = previousTrack.endKey
+
+            keyScores = np.zeros(len(keys))
 
             scoreHarmonicProximity(previousKey, keyScores)
             scoreDiatonicProximity(previousKey, keyScores)
@@ -49,26 +186,19 @@ def buildPlaylist(tracks: list[Track]):
             scoreHistoricProximity(keyBuffer  , keyScores)
 
         #   Randomize results a bit to make app reusable
-            for key in keyScores:
-                keyScores[key] += random.uniform(randomCoefficient * -1, randomCoefficient)
+            keyScores += [rng.uniform(randomCoefficient * -1, randomCoefficient) for key in keys]
 
-        #   Order the notes by score to retrieve the highest scoring note
-            keyScores = dict(sorted(keyScores.items(), key=lambda x: x[1], reverse=True))
+        #   Order the notes by score to retrieve the highest scoring note, ties keeping their chromatic order
+            keyOrder = np.argsort(-keyScores, kind="stable")
 
-        #   Shuffle remaining tracks and choose next track, prioritizing based on keyScores
-            random.shuffle(tracks)
+        #   Choose a random remaining track in the highest scoring key that has any
             nextTrack = None
-            for key in keyScores:
-                for track in tracks:
-                    if track.startKey.tonic == key:
-                        nextTrack = track
-                        break
-
-                if nextTrack is not None:
+            for keyIndex in keyOrder:
+                if trackIndex.count(keys[keyIndex]):
+                    nextTrack = trackIndex.pop(keys[keyIndex])
                     break
 
-            playlist.append(nextTrack)
-            tracks.remove(nextTrack)
+            yield nextTrack
 
             keylist  .append(nextTrack.startKey)
             keyBuffer.append(nextTrack.startKey)
@@ -76,71 +206,305 @@ def buildPlaylist(tracks: list[Track]):
                 keylist  .append(nextTrack.endKey)
                 keyBuffer.append(nextTrack.endKey)
 
-        return playlist
+            previousTrack = nextTrack
+            step         += 1
 
 
-def scoreNeighborProximity(keylist, keyScores):
+def buildRequestedPlaylist(request):
 
-    #   Increases the score of a previous neighbor in the case of 2nd movement (e.g. C - D), but only if we are certain
-    #   this is an isolated 2nd movement, so as to not create infinite neighbor loops. Results in higher chance of C - D - C
+    #   Runs in a worker of buildPlaylists, returning the positions in the shared library of the requested playlist
+
+        rng      = random.Random(request.seed)
+        playlist = generatePlaylist(sharedLibrary, rng = rng, trackIndex = sharedIndex.view(rng),
+                                    startingTonic = request.startingTonic, startingMode = request.startingMode)
+
+        return [sharedPositions[id(track)] for track in itertools.islice(playlist, request.size)]
+
+
+def setSharedLibrary(library):
+    global sharedLibrary, sharedPositions, sharedIndex
+
+    sharedLibrary   = library
+    sharedPositions = {id(track): i for i, track in enumerate(library)}
+    sharedIndex     = TrackIndex(library)
+
+
+class PlaylistRequest:
+
+    #   The PlaylistRequest describes one playlist of a batch: the seed of its random stream, its size (None for the
+    #   whole library), and optionally the tonic and mode it should start in
+
+        def __init__(self, seed, size = None, startingTonic = None, startingMode = None):
+            self.seed          = seed
+            self.size          = size
+            self.startingTonic = startingTonic
+            self.startingMode  = startingMode
+
+
+class PlaylistOptimizer:
+
+    #   The PlaylistOptimizer scores a playlist the way generatePlaylist scores its choices, without the random part:
+    #   each track after the first scores the harmonic, diatonic, neighbor and historic score of its starting tonic,
+    #   given the tracks before it. As the history is bounded, a track's score only depends on the few tracks before it,
+    #   so a swap is evaluated by rescoring the positions within that reach of the two swapped tracks only
+
+        def __init__(self, playlist):
+            self.tracks        = list(playlist)
+            self.order         = list(range(len(self.tracks)))
+            self.historyLength = getHistoryLength(len(self.tracks))
+            self.reach         = max(self.historyLength, 3)  # Previous tracks a position's score can depend on
+
+        #   Per track, its starting tonic, the table row of its ending key, and the tonics it adds to the history,
+        #   which differ for the first track as they do in generatePlaylist
+            self.startTonics  = [keyIndices[track.startKey.tonic] for track in self.tracks]
+            self.endRows      = [getKeyRow(track.endKey) for track in self.tracks]
+            self.history      = [getHistoryTonics(track, False) for track in self.tracks]
+            self.firstHistory = [getHistoryTonics(track, True)  for track in self.tracks]
+            self.transitions  = (harmonicTable + diatonicTable).tolist()
+
+            self.scores = [self.scorePosition(i) for i in range(len(self.order))]
+
+
+        def getPlaylist(self):
+            return [self.tracks[track] for track in self.order]
+
+
+        def getScore(self):
+            return sum(self.scores)
+
+
+        def scorePosition(self, i):
+            if i == 0:
+                return 0.0
+
+            tonic = self.startTonics[self.order[i]]
+            score = self.transitions[self.endRows[self.order[i - 1]]][tonic]
+
+        #   Gather the latest tonics of the history, most recent first
+            recent = []
+            j      = i - 1
+            while j >= 0 and len(recent) < self.reach:
+                recent.extend(reversed(self.firstHistory[self.order[j]] if j == 0 else self.history[self.order[j]]))
+                j -= 1
+
+            if len(recent) > 2 and tonic == recent[1]:
+                if neighborTable[recent[0], recent[1]] and not neighborTable[recent[1], recent[2]]:
+                    score += 1 * neighborCoefficient
+
+            keyBuffer = recent[:self.historyLength]
+            if keyBuffer:
+                score += keyBuffer.count(tonic) / len(keyBuffer) * historicalCoefficient
 
-        def neighborKeys(keyA, keyB):
+            return score
 
-            #   Returns true if the two given keys are within a second in proximity of each other (2 halfsteps)
 
-            if (abs(keys.index(keyA.tonic) - keys.index(keyB.tonic)) <= 2
-            or  abs(keys.index(keyA.tonic) - keys.index(keyB.tonic)) >= len(keys) - 2):
+        def trySwap(self, a, b):
+
+        #   Swaps the tracks at two positions if that raises the total score, returning whether it did
+            if a == b:
+                return False
+
+            positions = sorted(set(range(a, min(len(self.order), a + self.reach + 1))) |
+                               set(range(b, min(len(self.order), b + self.reach + 1))))
+
+            self.order[a], self.order[b] = self.order[b], self.order[a]
+
+            scores = [self.scorePosition(i) for i in positions]
+            if sum(scores) - sum(self.scores[i] for i in positions) > 1e-9:
+                for i, score in zip(positions, scores):
+                    self.scores[i] = score
+
                 return True
 
+            self.order[a], self.order[b] = self.order[b], self.order[a]
+
             return False
 
+
+class TrackIndex:
+
+    #   The TrackIndex holds the tracks remaining to be sequenced in pools by starting tonic and mode. Taking a random
+    #   track of a given tonic, or a given track, swaps it with the last track of its pool before popping it, so it
+    #   takes constant time. The pools and the position of each track in them are never modified once indexed: the
+    #   swaps, pops and additions of a playlist are kept in an overlay of the slots and positions they changed, so
+    #   that many playlists can draw from views of one index, each view costing only as much as the tracks it takes
+
+        def __init__(self, tracks, rng = random):
+            self.rng       = rng
+            self.pools     = {(key, mode): [] for key in keys for mode in modes}
+            self.positions = {}  # Position of each indexed track in its pool, by track id
+
+            for track in tracks:
+                pool = self.pools[(track.startKey.tonic, track.startKey.mode)]
+
+                self.positions[id(track)] = len(pool)
+                pool.append(track)
+
+            self.setOverlay()
+
+
+        def setOverlay(self):
+            self.lengths        = {poolKey: len(pool) for poolKey, pool in self.pools.items()}
+            self.movedTracks    = {}  # Tracks moved to, or added at, a slot of a pool, by pool key and position
+            self.movedPositions = {}  # Positions of the tracks moved or added since indexing, by track id
+            self.size           = sum(self.lengths.values())
+
+
+        def __len__(self):
+            return self.size
+
+
+        def view(self, rng = random):
+
+        #   Returns a TrackIndex sharing the pools of this one, holding the tracks this one held when it was indexed
+            trackIndex           = TrackIndex.__new__(TrackIndex)
+            trackIndex.rng       = rng
+            trackIndex.pools     = self.pools
+            trackIndex.positions = self.positions
+
+            trackIndex.setOverlay()
+
+            return trackIndex
+
+
+        def getTrack(self, poolKey, position):
+            track = self.movedTracks.get((poolKey, position))
+
+            return self.pools[poolKey][position] if track is None else track
+
+
+        def setTrack(self, poolKey, position, track):
+            self.movedTracks[(poolKey, position)] = track
+            self.movedPositions[id(track)]        = position
+
+
+        def add(self, track):
+            poolKey = (track.startKey.tonic, track.startKey.mode)
+
+            self.setTrack(poolKey, self.lengths[poolKey], track)
+            self.lengths[poolKey] += 1
+            self.size             += 1
+
+
+        def remove(self, track):
+            position = self.movedPositions.get(id(track))
+
+            self.popAt((track.startKey.tonic, track.startKey.mode),
+                       self.positions[id(track)] if position is None else position)
+
+
+        def count(self, tonic, mode = None):
+            if mode is None:
+                return sum(self.lengths[(tonic, mode)] for mode in modes)
+
+            return self.lengths[(tonic, mode)]
+
+
+        def pop(self, tonic, mode = None):
+
+        #   Removes and returns a random track starting in the given tonic (and mode), each with equal probability
+            position = self.rng.randrange(self.count(tonic, mode))
+
+            for poolKey in ([(tonic, mode)] if mode is not None else [(tonic, mode) for mode in modes]):
+                if position < self.lengths[poolKey]:
+                    return self.popAt(poolKey, position)
+
+                position -= self.lengths[poolKey]
+
+
+        def popRandom(self):
+
+        #   Removes and returns a random track of any key, each with equal probability
+            position = self.rng.randrange(self.size)
+
+            for poolKey, length in self.lengths.items():
+                if position < length:
+                    return self.popAt(poolKey, position)
+
+                position -= length
+
+
+        def popAt(self, poolKey, position):
+            last      = self.lengths[poolKey] - 1
+            track     = self.getTrack(poolKey, position)
+            lastTrack = self.getTrack(poolKey, last)
+
+            self.setTrack(poolKey, position, lastTrack)
+            self.movedTracks.pop((poolKey, last), None)
+            self.movedPositions.pop(id(track), None)
+
+            self.lengths[poolKey] -= 1
+            self.size             -= 1
+
+            return track
+
+
+def scoreNeighborProximity(keylist, keyScores):
+
+    #   Increases the score of a previous neighbor in the case of 2nd movement (e.g. C - D), but only if we are certain
+    #   this is an isolated 2nd movement, so as to not create infinite neighbor loops. Results in higher chance of C - D - C
+
         keylistSize = len(keylist)
         if keylistSize >= 2:
 
-            currentKey  = keylist[keylistSize - 1]
-            previousKey = keylist[keylistSize - 2]
+            currentKey  = keyIndices[keylist[keylistSize - 1].tonic]
+            previousKey = keyIndices[keylist[keylistSize - 2].tonic]
 
         #   Check if last two keys are a second apart
-            if neighborKeys(currentKey, previousKey):
+            if neighborTable[currentKey, previousKey]:
 
             #   Check to make sure we aren't perpetuating a neighbortone loop
                 if keylistSize > 2:
 
-                    tertiaryKey = keylist[keylistSize - 3]
+                    tertiaryKey = keyIndices[keylist[keylistSize - 3].tonic]
 
-                    if not neighborKeys(previousKey, tertiaryKey):
-                        keyScores[previousKey.tonic] += 1 * neighborCoefficient
+                    if not neighborTable[previousKey, tertiaryKey]:
+                        keyScores[previousKey] += 1 * neighborCoefficient
 
 
 def scoreHarmonicProximity(key, keyScores):
 
     #   Increases the score of keys in close harmonic proximity, e.g. A and G for key D
 
-        tonic = Note(key.tonic, 4, 0)
-
-        keyScores[tonic.pitchClass] += 1
-        for i in range(1, 6):
-            keyScores[tonic.getAdjacent(i *  7).pitchClass] += round(1 / i, 2) * harmonicCoefficient
-            keyScores[tonic.getAdjacent(i * -7).pitchClass] += round(1 / i, 2) * harmonicCoefficient
+        keyScores += harmonicTable[getKeyRow(key)]
 
 
 def scoreDiatonicProximity(key, keyScores):
 
     #   Increases the score of keys that fall under the current key's diatonic collection
 
-        tonic = Note(key.tonic, 4, 0)
-        scale = minorScale if key.mode == "minor" else majorScale
-
-        for i in scale:
-            keyScores[tonic.getAdjacent(i).pitchClass] += 1 * diatonicCoefficient
+        keyScores += diatonicTable[getKeyRow(key)]
 
 
 def scoreHistoricProximity(keyBuffer, keyScores):
 
-    #   Increases the score of keys that were present recently in the playlist
+    #   Increases the score of keys that were present recently in the playlist, one key at a time
+
+        np.add.at(keyScores, [keyIndices[key.tonic] for key in keyBuffer], (1 / max(1, len(keyBuffer))) * historicalCoefficient)
+
+
+def getHistoryLength(librarySize):
+
+    #   Returns how many of the latest keys count towards historic proximity
+
+        return librarySize // 5 if librarySize < 50 else 10
+
+
+def getHistoryTonics(track, first):
+
+    #   Returns the tonic indices a track adds to the key history. Only the first track compares its keys by tonic
+
+        if (track.startKey.tonic != track.endKey.tonic) if first else (track.startKey != track.endKey):
+            return (keyIndices[track.startKey.tonic], keyIndices[track.endKey.tonic])
+
+        return (keyIndices[track.startKey.tonic],)
+
+
+def getKeyRow(key):
+
+    #   Returns the row of a key in the score tables
 
-            for key in keyBuffer:
-                keyScores[key.tonic] += (1 / len(keyBuffer)) * historicalCoefficient
+        return keyIndices[key.tonic] * 2 + (key.mode == "minor")
 
 
 def getCircleOfFifths(key, keyScores):
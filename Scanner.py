@@ -0,0 +1,148 @@
+import App
+import FeatureCache
+import json
+import os
+import time
+from pathlib import Path
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+manifestName    = ".playlists-manifest.json"  # Default manifest file, kept at the top of the scanned directory
+manifestVersion = 1
+pollInterval    = 60                          # Seconds between scans in watch mode
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class Scanner:
+
+    #   The Scanner walks a directory tree and keeps a manifest of the size, modification time and content hash of each
+    #   supported audio file in it, so that a scan only returns the tracks added or changed since the last one, and the
+    #   paths deleted since. Files whose size and modification time are unchanged are not read at all; the others are
+    #   hashed, so that a file that was only touched is not returned, and the returned tracks carry their hash so that
+    #   analyzing them does not read them again. Files that cannot be read keep their previous entry and are reported
+    #   as unreadable rather than deleted. Scans update the manifest in memory, and save writes it to disk, which
+    #   should be done once the returned tracks are analyzed
+
+        def __init__(self, directory, manifestPath = None):
+            self.directory    = Path(directory)
+            self.manifestPath = Path(manifestPath) if manifestPath is not None else self.directory / manifestName
+            self.entries      = {}  # Manifest entries (size, modification time and hash), by file path
+
+            try:
+                with open(self.manifestPath) as file:
+                    manifest = json.load(file)
+
+                if manifest["version"] == manifestVersion:
+                    self.entries = manifest["entries"]
+            except (OSError, ValueError, KeyError):
+                pass
+
+
+        def scan(self):
+
+        #   Returns the tracks added and changed since the last scan, the paths deleted since, and the paths that
+        #   could not be read
+            result  = ScanResult()
+            entries = {}
+
+            for filePath, status in findFiles(self.directory, result):
+                entry = self.entries.get(filePath)
+                if entry is not None and entry["size"] == status.st_size and entry["mtime"] == status.st_mtime_ns:
+                    entries[filePath] = entry
+                    continue
+
+                try:
+                    contentHash = FeatureCache.hashFile(filePath)
+                except OSError:
+                    result.unreadable.append(filePath)
+                    if entry is not None:
+                        entries[filePath] = entry
+
+                    continue
+
+                entries[filePath] = {"size" : status.st_size, "mtime" : status.st_mtime_ns, "hash" : contentHash}
+
+                if entry is None:
+                    result.added.append(getTrack(filePath, contentHash))
+                elif entry["hash"] != contentHash:
+                    result.changed.append(getTrack(filePath, contentHash))
+
+            result.deleted = [filePath for filePath in self.entries if filePath not in entries]
+            self.entries   = entries
+
+            return result
+
+
+        def save(self):
+
+        #   Writes the manifest under a temporary name and renames it, so that an interrupted save keeps the last one
+            temporaryPath = self.manifestPath.with_name(self.manifestPath.name + "." + str(os.getpid()) + ".tmp")
+            with open(temporaryPath, "w") as file:
+                json.dump({"version" : manifestVersion, "entries" : self.entries}, file)
+
+            os.replace(temporaryPath, self.manifestPath)
+
+
+        def watch(self, callback, interval = pollInterval):
+
+        #   Polls the directory every interval seconds, passing each scan with any changes to the callback and saving
+        #   the manifest once it returns. Runs until interrupted
+            while True:
+                result = self.scan()
+
+                if result.added or result.changed or result.deleted:
+                    callback(result)
+                    self.save()
+
+                time.sleep(interval)
+
+
+class ScanResult:
+
+    #   The ScanResult holds the tracks a scan found added and changed, the paths it found deleted and could not read,
+    #   and how many unsupported files it skipped
+
+        def __init__(self):
+            self.added       = []
+            self.changed     = []
+            self.deleted     = []
+            self.unreadable  = []
+            self.unsupported = 0
+
+
+        def getTracks(self):
+            return self.added + self.changed
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def findFiles(directory, result = None):
+
+    #   Yields the path and status of every supported audio file under a directory, recursively, counting the
+    #   unsupported ones in the result if one is given. Hidden files (such as the manifest) are not counted, and
+    #   unreadable directories are skipped
+
+        try:
+            directoryEntries = list(os.scandir(directory))
+        except OSError:
+            return
+
+        for directoryEntry in directoryEntries:
+            try:
+                if directoryEntry.is_dir(follow_symlinks = False):
+                    yield from findFiles(directoryEntry.path, result)
+
+                elif directoryEntry.is_file():
+                    if Path(directoryEntry.name).suffix[1:].upper() in App.supportedFileExtensions:
+                        yield directoryEntry.path, directoryEntry.stat()
+                    elif result is not None and not directoryEntry.name.startswith("."):
+                        result.unsupported += 1
+            except OSError:
+                continue
+
+
+def getTrack(filePath, contentHash = None):
+    filePath          = Path(filePath)
+    track             = App.Track(str(filePath), filePath.suffix[1:], filePath.stem)
+    track.contentHash = contentHash
+
+    return track
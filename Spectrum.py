@@ -0,0 +1,330 @@
+import Metrics
+import numpy as np
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+minimumOvertones = 10    # Amount of significant overtones needed for a peak to be considered a fundamental
+overtoneTolerance = 0.8  # Proportion of its neighbors' power an overtone above the average must reach
+
+filterbankFrameSize = 2048  # Frame size of every level of a NoteFilterbank
+filterbankBandwidth = 0.4   # Highest band edge a NoteFilterbank level may hold, in proportion of its sample rate
+
+#   Kaiser-windowed sinc low-pass halving the bandwidth of a signal before it is decimated by 2
+halfbandFilter = np.sinc(np.arange(-20, 21) / 2) / 2 * np.kaiser(41, 5.0)
+
+#   np.fft.rfft only takes an output array from NumPy 2.0 on. Older versions allocate the spectra of every transform
+rfftOutput = np.lib.NumpyVersion(np.__version__) >= "2.0.0"
+
+noteThresholds = {}  # Band thresholds of sets of notes, by the names and frequencies of the notes, see getNoteThresholds
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class NotePowerEngine:
+
+    #   The NotePowerEngine precomputes the frequency bin ranges of a set of notes, their neighbors and their overtones
+    #   for one bin layout (sample rate and FFT size). Every power needed to detect fundamentals in a buffer can then be
+    #   gathered from a single prefix sum over its analysis, and the peak and overtone tests run on all notes at once
+
+        def __init__(self, notes, binSize, analysisLength):
+            self.notes          = list(notes)
+            self.binSize        = binSize
+            self.analysisLength = analysisLength
+
+        #   The bins of every threshold, as Note.getBinRange finds them, normalized the same way slicing the analysis
+        #   would normalize them, so that no range ends before it starts
+            indices = np.round((getNoteThresholds(self.notes) - 1) / binSize).astype(np.intp)
+            indices = np.where(indices < 0, np.maximum(indices + analysisLength, 0), np.minimum(indices, analysisLength))
+            ranges  = np.stack((indices[..., 0], np.maximum(indices[..., 0], indices[..., 1])), axis=-1)
+
+        #   Ranges are stored as (notes, [self, above, below], [lower, upper]) and
+        #   (notes, overtones, [self, above, below], [lower, upper]) index arrays
+            self.noteRanges     = np.ascontiguousarray(ranges[:, 0])
+            self.overtoneRanges = np.ascontiguousarray(ranges[:, 1:])
+
+
+        def getPowers(self, analysis):
+
+        #   Returns the powers of every note and overtone range, along with the running sum they were gathered from
+            prefix = np.empty(len(analysis) + 1, dtype=np.float64)
+            prefix[0] = 0.0
+            np.cumsum(analysis, out=prefix[1:])
+
+            notePowers     = prefix[self.noteRanges    [..., 1]] - prefix[self.noteRanges    [..., 0]]
+            overtonePowers = prefix[self.overtoneRanges[..., 1]] - prefix[self.overtoneRanges[..., 0]]
+
+            return notePowers, overtonePowers, prefix
+
+
+        def getFundamentals(self, analysis):
+
+        #   Returns the indices and powers of the notes whose peaks are backed by enough significant overtones
+            notePowers, overtonePowers, prefix = self.getPowers(analysis)
+
+            return detectFundamentals(notePowers, overtonePowers, prefix[-1] / len(analysis))
+
+
+class NoteFilterbank:
+
+    #   The NoteFilterbank measures the same note, neighbor and overtone bands as a NotePowerEngine laid out for
+    #   referenceSize-sample FFTs, without computing those FFTs. The signal is decimated into an octave pyramid, and
+    #   every level is transformed with short frames, giving each band the resolution of the finest level whose
+    #   bandwidth holds it. A single sparse product, kept as (band, bin, weight) triplets, maps the averaged spectra of
+    #   all levels to the band powers, scaled to the magnitudes of the reference FFT. Its analyses start with the
+    #   average reference bin magnitude, followed by the note and overtone band powers, and feed the same fundamental
+    #   test as the NotePowerEngine's
+
+        def __init__(self, notes, sampleRate, referenceSize, frameSize = filterbankFrameSize):
+            reference = NotePowerEngine(notes, 2 * sampleRate / referenceSize, referenceSize // 2)
+
+            self.notes         = reference.notes
+            self.overtoneCount = reference.overtoneRanges.shape[1]
+            self.referenceSize = referenceSize
+            self.frameSize     = frameSize
+            self.window        = np.blackman(frameSize)
+            self.levels        = max(1, (referenceSize // frameSize).bit_length())
+            self.binCount      = frameSize // 2 + 1
+
+        #   Band edges in hertz. Bin i of a reference analysis is bin i + 1 of its FFT, spanning half a bin either side
+            referenceWidth = sampleRate / referenceSize
+            bands = np.concatenate((reference.noteRanges.reshape(-1, 3, 2),
+                                    reference.overtoneRanges.reshape(-1, 3, 2))) + 0.5
+            bands = bands * referenceWidth
+
+        #   A note or overtone and its neighbors share the finest level holding all three, so they compare at one
+        #   resolution. Bands above every level's bandwidth stay empty
+            levelRates = sampleRate / 2.0 ** np.arange(self.levels)
+            fits       = bands[:, :, 1].max(axis=1)[:, np.newaxis] <= filterbankBandwidth * levelRates
+            held       = fits.any(axis=1)
+            level      = np.repeat(self.levels - 1 - np.argmax(fits[:, ::-1], axis=1)[held], 3)
+
+        #   Every bin a band overlaps, in band order, weighted by the proportion of the bin the band covers
+            width        = levelRates[level] / frameSize
+            lower, upper = bands[held].reshape(-1, 2).T
+            firstBins    = np.floor(lower / width + 0.5).astype(np.intp)
+            binCounts    = np.maximum(np.ceil(upper / width + 0.5).astype(np.intp) - firstBins, 0)
+
+            band    = np.repeat(np.arange(len(lower)), binCounts)
+            k       = firstBins[band] + np.arange(binCounts.sum()) - np.repeat(np.cumsum(binCounts) - binCounts, binCounts)
+            overlap = (np.minimum(upper[band], (k + 0.5) * width[band])
+                     - np.maximum(lower[band], (k - 0.5) * width[band]))
+            kept    = overlap > 0
+            band    = band[kept]
+
+            rows    = (1 + 3 * np.flatnonzero(held)[band // 3] + band % 3)
+            columns = level[band] * self.binCount + k[kept]
+            weights = overlap[kept] / width[band] * referenceSize / frameSize
+
+        #   The average magnitude of the finest bins of the full band stands in for that of the reference bins
+            rows    = np.concatenate(([0] * (self.binCount - 1), rows)).astype(np.intp)
+            columns = np.concatenate((np.arange(1, self.binCount), columns)).astype(np.intp)
+            weights = np.concatenate(([1 / (self.binCount - 1)] * (self.binCount - 1), weights))
+
+        #   Triplets are sorted by band, so that each band's products can be summed as one contiguous run
+            order = np.argsort(rows, kind="stable")
+
+            self.bandCount     = 1 + 3 * len(bands)
+            self.kernelColumns = columns[order]
+            self.kernelWeights = weights[order]
+            self.kernelBands, self.kernelStarts = np.unique(rows[order], return_index=True)
+
+
+        def getLevels(self, data):
+
+        #   Returns the octave pyramid of a signal: the signal, then each level decimated by 2 from the one before
+            levels = [np.asarray(data)]
+            for level in range(1, self.levels):
+                levels.append(np.convolve(levels[-1], halfbandFilter.astype(levels[-1].dtype), "same")[::2])
+
+            return levels
+
+
+        def getAnalyses(self, levels, offset, bufferFrameStarts):
+
+        #   Takes the octave pyramid of a region of signal beginning at sample offset and a list of reference frame
+        #   starts for each buffer, returning the band powers of every buffer, or None for buffers without any frames.
+        #   Each level is read with frames centered on the reference frames
+            framed  = [i for i, frameStarts in enumerate(bufferFrameStarts) if frameStarts]
+            if not framed:
+                return [None] * len(bufferFrameStarts)
+
+            centers = np.array([start for i in framed for start in bufferFrameStarts[i]], dtype=np.intp)
+            centers = centers - offset + self.referenceSize // 2
+            firsts  = np.cumsum([0] + [len(bufferFrameStarts[i]) for i in framed[:-1]])
+            counts  = np.array([len(bufferFrameStarts[i]) for i in framed])[:, np.newaxis]
+            spectra = np.zeros((len(framed), self.levels, self.binCount))
+            powers  = np.zeros((len(framed), self.bandCount))
+
+        #   Every frame of a level is transformed at once, then averaged by buffer
+            for level, data in enumerate(levels):
+                frames = np.lib.stride_tricks.sliding_window_view(data, self.frameSize)
+                starts = np.clip((centers >> level) - self.frameSize // 2, 0, len(frames) - 1)
+
+                segments  = frames[starts]
+                segments *= self.window.astype(segments.dtype, copy=False)
+
+                spectra[:, level] = np.add.reduceat(np.abs(np.fft.rfft(segments, axis=1)), firsts, axis=0) / counts
+
+        #   The sparse product, summing the weighted bins of each band
+            products = spectra.reshape(len(framed), -1)[:, self.kernelColumns] * self.kernelWeights
+            powers[:, self.kernelBands] = np.add.reduceat(products, self.kernelStarts, axis=1)
+
+            analyses = [None] * len(bufferFrameStarts)
+            for row, i in enumerate(framed):
+                analyses[i] = powers[row]
+
+            return analyses
+
+
+        def getFundamentals(self, analysis):
+
+        #   Returns the indices and powers of the notes whose peaks are backed by enough significant overtones
+            noteCount      = len(self.notes)
+            notePowers     = analysis[1 : 1 + 3 * noteCount].reshape(noteCount, 3)
+            overtonePowers = analysis[1 + 3 * noteCount:].reshape(noteCount, self.overtoneCount, 3)
+
+            return detectFundamentals(notePowers, overtonePowers, analysis[0])
+
+
+def getNoteThresholds(notes):
+
+    #   Returns the lower and upper thresholds, in hertz, of the bands of a set of notes, of their overtones, and of the
+    #   neighbors of each, as a (notes, 1 + overtones, [self, above, below], [lower, upper]) array. Thresholds don't
+    #   depend on the bin layout, so they are computed once per set of notes and shared by every layout
+
+        key = tuple((note.name, note.frequency) for note in notes)
+
+        if key not in noteThresholds:
+            noteThresholds[key] = np.array([[[note.getThresholds(),
+                                              note.getAdjacent( 1).getThresholds(),
+                                              note.getAdjacent(-1).getThresholds()]
+                                             for note in [fundamental] + fundamental.getOvertones()]
+                                            for fundamental in notes], dtype=np.intp)
+
+        return noteThresholds[key]
+
+
+def detectFundamentals(notePowers, overtonePowers, average):
+
+    #   Takes the powers of every note and its neighbors as a (notes x 3) array, the powers of their overtones and the
+    #   overtones' neighbors as a (notes x overtones x 3) array, and the average power of the analysis. Returns the
+    #   indices and powers of the notes whose peaks are backed by enough significant overtones
+
+    #   A note is a peak if its power is greater than that of both its neighbors
+        powers = notePowers[:, 0]
+        peaks  = powers > np.maximum(notePowers[:, 1], notePowers[:, 2])
+
+    #   An overtone is significant if it is a peak, or if it is above average and close to its neighbors' power
+        overtones         = overtonePowers[..., 0]
+        overtoneNeighbors = np.maximum(overtonePowers[..., 1], overtonePowers[..., 2])
+        validOvertones    = ((overtones > overtoneNeighbors)
+                          | ((overtones > average) & (overtones > overtoneNeighbors * overtoneTolerance)))
+
+        fundamentals = np.flatnonzero(peaks & (np.count_nonzero(validOvertones, axis=1) >= minimumOvertones))
+
+    #   Count the overtone tests a peak-by-peak search would have made
+        if Metrics.enabled:
+            peakCount = int(np.count_nonzero(peaks))
+
+            Metrics.count("peaksFound",        peakCount)
+            Metrics.count("overtoneTests",     peakCount * overtones.shape[1])
+            Metrics.count("fundamentalsFound", len(fundamentals))
+
+        return fundamentals, powers[fundamentals]
+
+
+class Stft:
+
+    #   The Stft object windows and transforms frames of a mono signal in batches. Frames are copied out of the signal,
+    #   so the signal itself is never modified, and the magnitude spectra of frames that several buffers share are
+    #   cached so that each unique frame is only transformed once. Frames are transformed in the signal's precision,
+    #   either by NumPy or by scipy.fft, whose workers split a batch across threads (the transforms release the GIL).
+    #   The segment and transform buffers are reused from batch to batch
+
+        def __init__(self, window, maxCachedFrames = 256, backend = "numpy", workers = 1):
+            self.window          = window
+            self.frameSize       = len(window)
+            self.maxCachedFrames = maxCachedFrames
+            self.backend         = backend
+            self.workers         = workers
+            self.spectra         = {}  # Magnitude spectra, by frame start
+            self.buffers         = {}  # Reused arrays, by name
+
+
+        def getAnalyses(self, data, offset, bufferFrameStarts):
+
+        #   Takes a region of signal beginning at sample offset and a list of frame starts for each buffer, returning
+        #   the averaged spectrum of every buffer, or None for buffers without any frames
+            requiredStarts = sorted({start for frameStarts in bufferFrameStarts for start in frameStarts})
+            missingStarts  = [start for start in requiredStarts if start not in self.spectra]
+
+            if missingStarts:
+            #   Frames are copied into the reused segment buffer, so the window is applied without touching the signal
+                segments = self.getBuffer("segments", (len(missingStarts), self.frameSize), data.dtype)
+                for segment, start in zip(segments, missingStarts):
+                    segment[:] = data[start - offset:start - offset + self.frameSize]
+
+                segments *= self.window.astype(segments.dtype, copy=False)
+
+            #   The magnitude of the real part is taken straight from the transform's real view, without copying it
+                spectra = np.abs(self.transform(segments).real)
+
+                for start, spectrum in zip(missingStarts, spectra):
+                    self.spectra[start] = spectrum
+
+            analyses = []
+            for frameStarts in bufferFrameStarts:
+                if frameStarts:
+                    analyses.append(self.getAverage(frameStarts))
+                else:
+                    analyses.append(None)
+
+            self.evict(requiredStarts[0] if requiredStarts else None)
+
+            return analyses
+
+
+        def transform(self, segments):
+            if self.backend == "scipy":
+                import scipy.fft
+
+                return scipy.fft.rfft(segments, axis=1, overwrite_x=True, workers=self.workers)
+
+            if not rfftOutput:
+                return np.fft.rfft(segments, axis=1)
+
+            output = self.getBuffer("transform", (len(segments), self.frameSize // 2 + 1),
+                                    np.result_type(segments.dtype, np.complex64))
+
+            return np.fft.rfft(segments, axis=1, out=output)
+
+
+        def getAverage(self, frameStarts):
+
+        #   Averages the spectra of some frames, adding them in order into a single new array
+            average = self.spectra[frameStarts[0]].copy()
+            for start in frameStarts[1:]:
+                average += self.spectra[start]
+
+            average /= len(frameStarts)
+
+            return average
+
+
+        def getBuffer(self, name, shape, dtype):
+
+        #   Returns an array of the given shape, taken from the start of a reused array that only grows when needed
+            buffer = self.buffers.get(name)
+            if buffer is None or buffer.dtype != dtype or buffer.shape[1:] != shape[1:] or len(buffer) < shape[0]:
+                buffer = self.buffers[name] = np.empty(shape, dtype=dtype)
+
+            return buffer[:shape[0]]
+
+
+        def evict(self, earliestStart):
+
+        #   Frames starting before the earliest frame of the latest batch will not be needed by later buffers
+            if earliestStart is not None:
+                self.spectra = {start: spectrum for start, spectrum in self.spectra.items() if start >= earliestStart}
+
+            while len(self.spectra) > self.maxCachedFrames:
+                del self.spectra[next(iter(self.spectra))]
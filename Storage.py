@@ -0,0 +1,162 @@
+import json
+import sqlite3
+from abc import ABC, abstractmethod
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+trackFields  = ("track", "startingKey", "closingKey", "startingRelativeKey", "closingRelativeKey")
+tuningFields = ("score", "genre", "coefficients")
+bufferSize   = 100                # Tunings kept in memory before they are written together
+databaseName = "MusicalPlaylists"
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class Storage(ABC):
+
+    #   Base class of the databases holding the reference keys of the training tracks and the tunings found by
+    #   MachineLearner. Reads only fetch the fields that are used, and tunings are buffered and written bufferSize at a
+    #   time, as well as when the storage is flushed or closed
+
+        def __init__(self, bufferSize = bufferSize):
+            self.bufferSize = bufferSize
+            self.pending    = []
+
+
+        def __enter__(self):
+            return self
+
+
+        def __exit__(self, *exception):
+            self.close()
+
+
+        @abstractmethod
+        def getTrackDocuments(self):
+
+        #   Returns the reference keys of every training track, as dictionaries of the trackFields
+            pass
+
+
+        @abstractmethod
+        def addTrackDocuments(self, trackDocuments):
+            pass
+
+
+        @abstractmethod
+        def getTunings(self, genre):
+
+        #   Returns the score and coefficients of every tuning of a genre, best first
+            pass
+
+
+        def addTuning(self, tuningDocument):
+            self.pending.append(tuningDocument)
+
+            if len(self.pending) >= self.bufferSize:
+                self.flush()
+
+
+        def flush(self):
+            if self.pending:
+                self.insertTunings(self.pending)
+                self.pending = []
+
+
+        @abstractmethod
+        def insertTunings(self, tuningDocuments):
+            pass
+
+
+        def close(self):
+            self.flush()
+
+
+class MongoStorage(Storage):
+
+    #   Storage in a MongoDB database. Clients are shared by connection string, so that reopening a storage reuses the
+    #   client's connection pool. Requires pymongo
+
+        clients = {}
+
+        def __init__(self, location, bufferSize = bufferSize):
+            Storage.__init__(self, bufferSize)
+
+            if location not in MongoStorage.clients:
+                from pymongo import MongoClient
+                MongoStorage.clients[location] = MongoClient(location)
+
+            self.database = MongoStorage.clients[location][databaseName]
+
+
+        def getTrackDocuments(self):
+            return list(self.database.Tracks.find({}, dict.fromkeys(trackFields, 1) | {"_id": 0}))
+
+
+        def addTrackDocuments(self, trackDocuments):
+            self.database.Tracks.insert_many([dict(trackDocument) for trackDocument in trackDocuments], ordered = False)
+
+
+        def getTunings(self, genre):
+            projection = {"score": 1, "coefficients": 1, "_id": 0}
+
+            return list(self.database.Tunings.find({"genre": genre}, projection).sort("score", -1))
+
+
+        def insertTunings(self, tuningDocuments):
+
+        #   insert_many adds an _id to the documents it is given, so it is given copies
+            self.database.Tunings.insert_many([dict(tuningDocument) for tuningDocument in tuningDocuments], ordered = False)
+
+
+class SqliteStorage(Storage):
+
+    #   Storage in an SQLite database file, for tuning without access to the MongoDB cluster. Tunings are indexed by
+    #   genre and score, and coefficients are stored as JSON
+
+        def __init__(self, location, bufferSize = bufferSize):
+            Storage.__init__(self, bufferSize)
+
+            self.connection = sqlite3.connect(location)
+
+            with self.connection:
+                self.connection.execute("CREATE TABLE IF NOT EXISTS Tracks (track TEXT PRIMARY KEY, startingKey TEXT, "
+                                        "closingKey TEXT, startingRelativeKey TEXT, closingRelativeKey TEXT)")
+                self.connection.execute("CREATE TABLE IF NOT EXISTS Tunings (score REAL, genre TEXT, coefficients TEXT)")
+                self.connection.execute("CREATE INDEX IF NOT EXISTS TuningsByGenre ON Tunings (genre, score DESC)")
+                self.connection.execute("CREATE INDEX IF NOT EXISTS TuningsByScore ON Tunings (score DESC)")
+
+
+        def getTrackDocuments(self):
+            rows = self.connection.execute("SELECT " + ", ".join(trackFields) + " FROM Tracks")
+
+            return [dict(zip(trackFields, row)) for row in rows]
+
+
+        def addTrackDocuments(self, trackDocuments):
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO Tracks VALUES (?, ?, ?, ?, ?)",
+                                            [[trackDocument.get(field) for field in trackFields]
+                                             for trackDocument in trackDocuments])
+
+
+        def getTunings(self, genre):
+            rows = self.connection.execute("SELECT score, coefficients FROM Tunings WHERE genre = ? ORDER BY score DESC",
+                                           (genre,))
+
+            return [{"score": score, "coefficients": json.loads(coefficients)} for score, coefficients in rows]
+
+
+        def insertTunings(self, tuningDocuments):
+            with self.connection:
+                self.connection.executemany("INSERT INTO Tunings VALUES (?, ?, ?)",
+                                            [(x["score"], x["genre"], json.dumps(x["coefficients"]))
+                                             for x in tuningDocuments])
+
+
+        def close(self):
+            Storage.close(self)
+            self.connection.close()
+
+
+backends = {"mongo"  : MongoStorage,
+            "sqlite" : SqliteStorage}
@@ -0,0 +1,247 @@
+import App
+import numpy as np
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+presenceNames = ("presence", "startPresence", "endPresence")  # Presences of the cube, in order
+modes         = ("major", "minor")
+noKey         = -1                                            # Key code of a track whose keys aren't identified
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class TrackTable:
+
+    #   The TrackTable holds the features and keys of a library in columns rather than in Track objects: a
+    #   (tracks x 3 x 12) cube of presences ordered as presenceNames, the starting and ending keys as codes (2 * tonic
+    #   index, plus 1 if minor, as rows of the Playlists tables), durations in seconds, halfway samples, and the names
+    #   and file paths of the tracks, packed as UTF-8. It is saved and loaded in one call.
+    #
+    #   The table is also a sequence of TrackRows, views of one row each which are created once, the first time they
+    #   are needed. Playlists runs on the rows as it does on Tracks, without the presences of every track being
+    #   unpacked into dictionaries
+
+        def __init__(self, size = 0):
+            self.presences      = np.zeros((size, len(presenceNames), 12), dtype=np.float32)
+            self.startKeys      = np.full(size, noKey, dtype=np.int8)
+            self.endKeys        = np.full(size, noKey, dtype=np.int8)
+            self.durations      = np.zeros(size, dtype=np.float32)
+            self.halfwaySamples = np.zeros(size, dtype=np.int64)
+            self.names          = StringColumn([""] * size)
+            self.filePaths      = StringColumn([""] * size)
+            self.rows           = None
+
+            self.setKeyObjects()
+
+
+        def __len__(self):
+            return len(self.presences)
+
+
+        def __getitem__(self, row):
+            return self.getRows()[row]
+
+
+        def __iter__(self):
+            return iter(self.getRows())
+
+
+        def setKeyObjects(self):
+
+        #   The Keys that rows return, one per code, followed by None, which noKey indexes. Starting and ending keys
+        #   are separate objects, as they are for an analyzed Track, which Playlists tells apart by identity
+            self.startKeyObjects = [App.Key(*getKeyNames(code)) for code in range(24)] + [None]
+            self.endKeyObjects   = [App.Key(*getKeyNames(code)) for code in range(24)] + [None]
+
+
+        def getRows(self):
+            if self.rows is None:
+                self.rows = [TrackRow(self, row) for row in range(len(self))]
+
+            return self.rows
+
+
+        @classmethod
+        def fromTracks(cls, tracks):
+
+        #   Returns a table of the features and keys of a list of analyzed Tracks
+            table = cls(len(tracks))
+
+            for row, track in enumerate(tracks):
+                table.setTrack(row, track)
+
+            return table
+
+
+        def setTrack(self, row, track):
+
+        #   Copies the features and keys of a Track into a row
+            self.presences[row] = [[getattr(track, presenceName)[note] for note in App.chromaticScale]
+                                   for presenceName in presenceNames]
+            self.startKeys[row]      = getKeyCode(track.startKey)
+            self.endKeys[row]        = getKeyCode(track.endKey)
+            self.durations[row]      = track.duration or 0.0
+            self.halfwaySamples[row] = track.halfwaySample or 0
+            self.names[row]          = track.name
+            self.filePaths[row]      = track.filePath
+
+
+        def take(self, rows):
+
+        #   Returns a new table of the given rows, in the given order
+            table = TrackTable()
+
+            table.presences      = self.presences[rows]
+            table.startKeys      = self.startKeys[rows]
+            table.endKeys        = self.endKeys[rows]
+            table.durations      = self.durations[rows]
+            table.halfwaySamples = self.halfwaySamples[rows]
+            table.names          = StringColumn([self.names[row] for row in rows])
+            table.filePaths      = StringColumn([self.filePaths[row] for row in rows])
+
+            return table
+
+
+        def getEasyKey(self, row):
+
+        #   Returns the easy key of a row, or None if its keys aren't identified, as for an unanalyzed Track
+            if self.startKeys[row] == noKey:
+                return None
+
+            startTonic = App.chromaticScale[self.startKeys[row] // 2]
+            endTonic   = App.chromaticScale[self.endKeys[row]   // 2]
+
+            return startTonic if startTonic == endTonic else startTonic + " - " + endTonic
+
+
+        def save(self, path):
+            np.savez(path, presences = self.presences, startKeys = self.startKeys, endKeys = self.endKeys,
+                     durations = self.durations, halfwaySamples = self.halfwaySamples,
+                     nameData = self.names.data, nameOffsets = self.names.offsets,
+                     filePathData = self.filePaths.data, filePathOffsets = self.filePaths.offsets)
+
+
+        @classmethod
+        def load(cls, path):
+            table = cls()
+
+            with np.load(path) as columns:
+                table.presences      = columns["presences"]
+                table.startKeys      = columns["startKeys"]
+                table.endKeys        = columns["endKeys"]
+                table.durations      = columns["durations"]
+                table.halfwaySamples = columns["halfwaySamples"]
+                table.names          = StringColumn.fromArrays(columns["nameData"], columns["nameOffsets"])
+                table.filePaths      = StringColumn.fromArrays(columns["filePathData"], columns["filePathOffsets"])
+
+            return table
+
+
+class TrackRow:
+
+    #   The TrackRow is a view of one row of a TrackTable, with the attributes of a Track that playlists need
+
+        __slots__ = ("table", "row")
+
+        def __init__(self, table, row):
+            self.table = table
+            self.row   = row
+
+
+        @property
+        def startKey(self):
+            return self.table.startKeyObjects[self.table.startKeys[self.row]]
+
+
+        @property
+        def endKey(self):
+            return self.table.endKeyObjects[self.table.endKeys[self.row]]
+
+
+        @property
+        def easyKey(self):
+            return self.table.getEasyKey(self.row)
+
+
+        @property
+        def name(self):
+            return self.table.names[self.row]
+
+
+        @property
+        def filePath(self):
+            return self.table.filePaths[self.row]
+
+
+class StringColumn:
+
+    #   The StringColumn holds a column of strings as one UTF-8 array and the offsets at which each string starts, so
+    #   that a million names take little more memory than their characters. Strings can be replaced until the column
+    #   is packed, which happens the first time its arrays are needed
+
+        def __init__(self, strings):
+            self.strings = list(strings)
+            self.packed  = None
+
+
+        @classmethod
+        def fromArrays(cls, data, offsets):
+            column         = cls([])
+            column.strings = None
+            column.packed  = (data, offsets)
+
+            return column
+
+
+        def __len__(self):
+            return len(self.strings) if self.strings is not None else len(self.packed[1]) - 1
+
+
+        def __getitem__(self, i):
+            if self.strings is not None:
+                return self.strings[i]
+
+            data, offsets = self.packed
+            return data[offsets[i] : offsets[i + 1]].tobytes().decode()
+
+
+        def __setitem__(self, i, string):
+            if self.strings is None:
+                self.strings = [self[j] for j in range(len(self))]
+
+            self.strings[i] = string
+            self.packed     = None
+
+
+        @property
+        def data(self):
+            return self.pack()[0]
+
+
+        @property
+        def offsets(self):
+            return self.pack()[1]
+
+
+        def pack(self):
+            if self.packed is None:
+                encoded = [string.encode() for string in self.strings]
+                offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+                np.cumsum([len(string) for string in encoded], out=offsets[1:])
+
+                self.packed  = (np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+                self.strings = None
+
+            return self.packed
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def getKeyCode(key):
+    if key is None:
+        return noKey
+
+    return 2 * App.chromaticScale.index(key.tonic) + (key.mode == "minor")
+
+
+def getKeyNames(code):
+    return App.chromaticScale[code // 2], modes[code % 2]
+
@@ -0,0 +1,310 @@
+import Analyzer
+import numpy as np
+from abc import ABC, abstractmethod
+from math import ceil, log, sqrt
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+lowerBounds = np.array([coefficientRange[0] for coefficientRange in Analyzer.coefficientRanges], dtype=np.float64)
+upperBounds = np.array([coefficientRange[1] for coefficientRange in Analyzer.coefficientRanges], dtype=np.float64)
+dimensions  = len(Analyzer.coefficientNames)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class Optimizer(ABC):
+
+    #   Base class of the configuration search strategies used by MachineLearner. Optimizers search the coefficient
+    #   ranges of Analyzer in normalized [0, 1] coordinates and maximize the score returned by an evaluation function.
+    #   The evaluation function takes a list of configurations and a list of track indices (None for every track),
+    #   returning the score of each configuration on those tracks. Budgets are counted in full-library evaluations
+
+        def __init__(self, seed = None, batchSize = 10):
+            self.rng               = np.random.default_rng(seed)
+            self.batchSize         = batchSize
+            self.bestConfiguration = None
+            self.bestScore         = -np.inf
+            self.evaluations       = 0.0
+
+
+        def resume(self, tuningDocuments):
+
+        #   Takes previously uploaded tuning documents so that the search continues from their results
+            for tuningDocument in tuningDocuments:
+                self.observe(Analyzer.Configuration(tuningDocument["coefficients"]), tuningDocument["score"])
+
+
+        def observe(self, configuration, score):
+            if score > self.bestScore:
+                self.bestScore         = score
+                self.bestConfiguration = configuration
+
+
+        @abstractmethod
+        def ask(self):
+
+        #   Returns the next configurations to be evaluated on every track
+            pass
+
+
+        def tell(self, configurations, scores):
+
+        #   Takes the scores of the configurations returned by ask
+            for configuration, score in zip(configurations, scores):
+                self.observe(configuration, score)
+
+
+        def optimize(self, evaluate, trackCount, evaluations, targetScore = None, record = None):
+
+        #   Searches until the given amount of full-library evaluations is spent, or until a configuration reaches the
+        #   target score. Every fully evaluated configuration is passed to record along with its score
+            while self.evaluations < evaluations and not self.reachedTarget(targetScore):
+                configurations = self.ask()[:int(ceil(evaluations - self.evaluations))]
+                scores         = evaluate(configurations, None)
+
+                self.evaluations += len(configurations)
+                self.tell(configurations, scores)
+                recordResults(record, configurations, scores)
+
+            return self.bestConfiguration, self.bestScore
+
+
+        def reachedTarget(self, targetScore):
+            return targetScore is not None and self.bestScore >= targetScore
+
+
+class RandomSearch(Optimizer):
+
+    #   Baseline search drawing every configuration independently and uniformly from the coefficient ranges
+
+        def ask(self):
+            return [toConfiguration(point) for point in self.rng.random((self.batchSize, dimensions))]
+
+
+class CmaEs(Optimizer):
+
+    #   Covariance matrix adaptation evolution strategy. Samples populations from a multivariate normal distribution
+    #   and moves its mean and covariance towards the best scoring configurations of each generation. Samples outside
+    #   the coefficient ranges are clipped to them before being evaluated and used in the update
+
+        def __init__(self, seed = None, batchSize = None, sigma = 0.3):
+            Optimizer.__init__(self, seed, batchSize or 4 + int(3 * log(dimensions)))
+
+            self.parents = self.batchSize // 2
+
+            weights      = log(self.parents + 0.5) - np.log(np.arange(1, self.parents + 1))
+            self.weights = weights / weights.sum()
+            self.mueff   = 1 / np.sum(self.weights ** 2)
+
+        #   Learning rates of the evolution paths, the covariance matrix and the step size
+            n = dimensions
+            self.cc    = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+            self.cs    = (self.mueff + 2) / (n + self.mueff + 5)
+            self.c1    = 2 / ((n + 1.3) ** 2 + self.mueff)
+            self.cmu   = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) / ((n + 2) ** 2 + self.mueff))
+            self.damps = 1 + 2 * max(0, sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+            self.chiN  = sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+
+            self.mean        = np.full(n, 0.5)
+            self.sigma       = sigma
+            self.pathSigma   = np.zeros(n)
+            self.pathC       = np.zeros(n)
+            self.covariance  = np.eye(n)
+            self.eigenbasis  = np.eye(n)
+            self.eigenvalues = np.ones(n)
+            self.generations = 0
+
+
+        def resume(self, tuningDocuments):
+
+        #   Start the distribution at the weighted mean of the best previous configurations
+            Optimizer.resume(self, tuningDocuments)
+
+            tuningDocuments = sorted(tuningDocuments, key=lambda x: x["score"], reverse=True)[:self.parents]
+            if tuningDocuments:
+                points    = np.array([toPoint(Analyzer.Configuration(x["coefficients"])) for x in tuningDocuments])
+                weights   = self.weights[:len(points)] / self.weights[:len(points)].sum()
+                self.mean = weights @ points
+
+
+        def ask(self):
+            samples = self.rng.standard_normal((self.batchSize, dimensions))
+            points  = self.mean + self.sigma * (samples * np.sqrt(self.eigenvalues)) @ self.eigenbasis.T
+
+            return [toConfiguration(point) for point in np.clip(points, 0, 1)]
+
+
+        def tell(self, configurations, scores):
+            Optimizer.tell(self, configurations, scores)
+
+            if len(configurations) < self.batchSize:
+                return
+
+            n      = dimensions
+            order  = np.argsort(-np.asarray(scores, dtype=np.float64), kind="stable")[:self.parents]
+            points = np.array([toPoint(configurations[i]) for i in order])
+
+            previousMean = self.mean
+            self.mean    = self.weights @ points
+            step         = (self.mean - previousMean) / self.sigma
+
+            self.generations += 1
+
+        #   Update the evolution paths, using the inverse square root of the covariance for the step size path
+            inverseRoot    = self.eigenbasis @ np.diag(1 / np.sqrt(self.eigenvalues)) @ self.eigenbasis.T
+            self.pathSigma = (1 - self.cs) * self.pathSigma + sqrt(self.cs * (2 - self.cs) * self.mueff) * inverseRoot @ step
+
+            stalled = (np.linalg.norm(self.pathSigma) / sqrt(1 - (1 - self.cs) ** (2 * self.generations))
+                       / self.chiN >= 1.4 + 2 / (n + 1))
+            self.pathC = (1 - self.cc) * self.pathC + (not stalled) * sqrt(self.cc * (2 - self.cc) * self.mueff) * step
+
+        #   Rank-one and rank-mu updates of the covariance matrix, followed by step size adaptation
+            steps = (points - previousMean) / self.sigma
+            self.covariance = ((1 - self.c1 - self.cmu) * self.covariance
+                             + self.c1 * (np.outer(self.pathC, self.pathC) + stalled * self.cc * (2 - self.cc) * self.covariance)
+                             + self.cmu * (steps.T * self.weights) @ steps)
+
+            self.sigma *= np.exp((self.cs / self.damps) * (np.linalg.norm(self.pathSigma) / self.chiN - 1))
+
+            self.covariance = np.triu(self.covariance) + np.triu(self.covariance, 1).T
+            eigenvalues, self.eigenbasis = np.linalg.eigh(self.covariance)
+            self.eigenvalues = np.maximum(eigenvalues, 1e-20)
+
+
+class Hyperband(RandomSearch):
+
+    #   Runs brackets of successive halving. Each bracket scores many random configurations on a small random subset of
+    #   tracks, keeps the best 1 / eta of them, and scores the survivors on eta times as many tracks, until the last
+    #   few are scored on every track. Brackets range from aggressive (minimumFraction of the library first) to a
+    #   plain full-library evaluation, so that neither a noisy subset nor a slow full evaluation dominates. Brackets
+    #   that the remaining budget cannot complete are skipped, and the search stops once none of them fits
+
+        def __init__(self, seed = None, eta = 3, minimumFraction = 1 / 27):
+            RandomSearch.__init__(self, seed)
+
+            self.eta           = eta
+            self.maximumRounds = int(round(log(1 / minimumFraction, eta)))
+            self.candidates    = []  # Configurations from previous runs to include in the next bracket
+
+
+        def resume(self, tuningDocuments):
+            Optimizer.resume(self, tuningDocuments)
+
+            tuningDocuments = sorted(tuningDocuments, key=lambda x: x["score"], reverse=True)
+            self.candidates = [Analyzer.Configuration(x["coefficients"]) for x in tuningDocuments[:self.eta]]
+
+
+        def getBrackets(self):
+            return range(self.maximumRounds, -1, -1)
+
+
+        def optimize(self, evaluate, trackCount, evaluations, targetScore = None, record = None):
+            while not self.reachedTarget(targetScore):
+                bracketsRun = 0
+
+                for rounds in self.getBrackets():
+                    if self.reachedTarget(targetScore):
+                        break
+
+                    if self.evaluations + self.getBracketCost(trackCount, rounds) > evaluations:
+                        continue
+
+                    self.runBracket(evaluate, trackCount, rounds, record)
+                    bracketsRun += 1
+
+            #   Stop once the remaining budget cannot complete any bracket
+                if bracketsRun == 0:
+                    break
+
+            return self.bestConfiguration, self.bestScore
+
+
+        def getBracketCount(self, rounds):
+            return int(ceil((self.maximumRounds + 1) / (rounds + 1) * self.eta ** rounds))
+
+
+        def getSubsetSize(self, trackCount, rounds, i):
+            return min(trackCount, int(ceil(trackCount * self.eta ** (i - rounds))))
+
+
+        def getBracketCost(self, trackCount, rounds):
+
+        #   Returns the full-library evaluations a bracket spends, following the same halving as runBracket
+            count = self.getBracketCount(rounds)
+            cost  = 0.0
+
+            for i in range(rounds + 1):
+                subsetSize = self.getSubsetSize(trackCount, rounds, i)
+                cost      += count * subsetSize / trackCount
+
+                if subsetSize == trackCount:
+                    break
+
+                count = max(1, count // self.eta)
+
+            return cost
+
+
+        def runBracket(self, evaluate, trackCount, rounds, record):
+
+        #   Successive halving over nested random subsets of the tracks, starting from eta ^ -rounds of the library
+            count          = self.getBracketCount(rounds)
+            configurations = self.candidates[:count]
+            configurations = configurations + [toConfiguration(x) for x in self.rng.random((count - len(configurations), dimensions))]
+            trackOrder     = self.rng.permutation(trackCount)
+
+            self.candidates = []
+
+            for i in range(rounds + 1):
+                subsetSize = self.getSubsetSize(trackCount, rounds, i)
+                cost       = len(configurations) * subsetSize / trackCount
+
+                fullLibrary = subsetSize == trackCount
+                scores      = evaluate(configurations, None if fullLibrary else np.sort(trackOrder[:subsetSize]))
+
+                self.evaluations += cost
+
+                if fullLibrary:
+                    self.tell(configurations, scores)
+                    recordResults(record, configurations, scores)
+                    return
+
+                survivors      = np.argsort(-np.asarray(scores, dtype=np.float64), kind="stable")
+                survivors      = survivors[:max(1, len(configurations) // self.eta)]
+                configurations = [configurations[j] for j in survivors]
+
+
+class SuccessiveHalving(Hyperband):
+
+    #   A single, repeated successive halving bracket starting from minimumFraction of the library
+
+        def getBrackets(self):
+            return [self.maximumRounds]
+
+
+optimizers = {"random"            : RandomSearch,
+              "cmaes"             : CmaEs,
+              "hyperband"         : Hyperband,
+              "successiveHalving" : SuccessiveHalving}
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def toConfiguration(point):
+
+    #   Converts a point of the normalized search space to a Configuration
+
+        coefficients = lowerBounds + np.clip(point, 0, 1) * (upperBounds - lowerBounds)
+
+        return Analyzer.Configuration(dict(zip(Analyzer.coefficientNames, coefficients.tolist())))
+
+
+def toPoint(configuration):
+
+    #   Converts a Configuration to a point of the normalized search space
+
+        return np.clip((configuration.toArray() - lowerBounds) / (upperBounds - lowerBounds), 0, 1)
+
+
+def recordResults(record, configurations, scores):
+    if record is not None:
+        for configuration, score in zip(configurations, scores):
+            record(configuration, score)